@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2022 United States Government as represented by the Administrator of the
+# National Aeronautics and Space Administration. All Rights Reserved.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+
+# Benchmark of repository resolution, cloning and updating against local stand-ins for GitHub.
+#
+# Usage: python benchmarks/benchmark_clone.py --repos 10,50 --orgs 1,3 --output results.json
+
+# --------------------------------------------------------------------------------------------------
+
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_github_api import FakeGitHubApi
+from synthetic_repos import generate_repos, push_new_commit
+
+from jedi_bundle.utils import git
+from jedi_bundle.utils.cache import ResolutionCache
+from jedi_bundle.utils.logger import Logger
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def timed(function, *args, **kwargs):
+
+    start_time = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start_time
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def resolve_and_clone(logger, api, root, source, orgs, repos, user_branch, resolve_workers,
+                      clone_workers, cache_dir, cache_ttl, clone_settings, clone=True):
+
+    # Resolution as done by clone_jedi, cloning each repo as soon as it is resolved unless clone is
+    # False. Each call starts like a new run, without the refs listed by an earlier one.
+    git.ref_indices.clear()
+
+    github_url = f'file://{root}'
+    resolution_cache = ResolutionCache(logger, cache_dir, cache_ttl, negative_ttl=cache_ttl,
+                                       github_url=github_url, github_api_url=api.url())
+    with git.GitHubSession(logger, resolve_workers, github_url=github_url,
+                           github_api_url=api.url()) as github_session:
+        repo_tuples = [(repo, 'develop', False) for repo in repos]
+        targets = [os.path.join(source, repo) for repo in repos]
+        clone_flags = [clone] * len(repos)
+        required_flags = [True] * len(repos)
+        return git.resolve_and_clone_git_repos(logger, github_session, orgs, repos, repo_tuples,
+                                               user_branch, targets, clone_flags, required_flags,
+                                               resolve_workers, clone_workers, clone_settings,
+                                               resolution_cache)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def run_scenarios(logger, work_dir, repo_count, org_count, args):
+
+    root = os.path.join(work_dir, 'remotes')
+    source = os.path.join(work_dir, 'source')
+    resolve_cache_dir = os.path.join(work_dir, 'resolve_cache')
+    clone_cache_dir = os.path.join(work_dir, 'clone_cache')
+
+    repos, orgs = generate_repos(root, repo_count, org_count, args.files_per_repo,
+                                 args.user_branch)
+
+    clone_settings = {'depth': args.clone_depth}
+
+    results = []
+
+    def record(scenario, seconds, api, api_requests_before, **extra):
+        result = {
+            'scenario': scenario,
+            'repos': repo_count,
+            'orgs': org_count,
+            'seconds': round(seconds, 4),
+            'api_requests': api.requests - api_requests_before,
+        }
+        result.update(extra)
+        results.append(result)
+        print(f'{scenario:24s} repos={repo_count:5d} orgs={org_count:3d} ' +
+              f'{seconds:9.3f}s api_requests={result["api_requests"]}')
+
+    def run(scenario, cache_dir, clone):
+        requests_before = api.requests
+        (resolved, statuses), seconds = timed(resolve_and_clone, logger, api, root, source, orgs,
+                                              repos, args.user_branch, args.resolve_workers,
+                                              args.clone_workers, cache_dir, 3600, clone_settings,
+                                              clone)
+        if not all(result[0] for result in resolved):
+            raise RuntimeError('Not all the synthetic repos were resolved.')
+        extra = {'statuses': sorted(set(statuses))} if clone else {}
+        record(scenario, seconds, api, requests_before, **extra)
+        return resolved
+
+    with FakeGitHubApi(root, args.api_latency) as api:
+
+        # Resolution only, with an empty cache, then with the cache filled by the first run
+        run('resolve_cold', resolve_cache_dir, False)
+        run('resolve_warm', resolve_cache_dir, False)
+
+        # Fresh clone of every repo, each started as soon as the repo is resolved, with an empty
+        # cache
+        resolved = run('clone', clone_cache_dir, True)
+
+        # Rerun when the remotes have not changed, the local commits match the remote ones
+        run('update_unchanged', clone_cache_dir, True)
+
+        # Rerun after a new commit on every resolved branch, every repo is fetched
+        for index, (repo, (_, _, branch, _)) in enumerate(zip(repos, resolved)):
+            push_new_commit(root, orgs[index % org_count], repo, branch)
+        run('update_new_commits', clone_cache_dir, True)
+
+    return results
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the resolution and cloning of ' +
+                                     'repositories against local stand-ins for GitHub.')
+    parser.add_argument('--repos', type=str, default='10,50',
+                        help='Comma separated numbers of repos to benchmark.')
+    parser.add_argument('--orgs', type=str, default='1,3',
+                        help='Comma separated numbers of organizations to benchmark.')
+    parser.add_argument('--files-per-repo', type=int, default=20)
+    parser.add_argument('--user-branch', type=str, default='feature/bench')
+    parser.add_argument('--resolve-workers', type=int, default=8)
+    parser.add_argument('--clone-workers', type=int, default=4)
+    parser.add_argument('--clone-depth', type=int, default=0)
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help='Seconds added to every API request to mimic the network.')
+    parser.add_argument('--output', type=str, default='benchmark_clone.json',
+                        help='File the JSON results are written to.')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Show the output of jedi_bundle.')
+    args = parser.parse_args()
+
+    # The jedi_bundle output is hidden unless asked for
+    if not args.verbose:
+        os.environ['LOG_INFO'] = '0'
+    logger = Logger('Benchmark')
+
+    git_version = subprocess.run(['git', '--version'], stdout=subprocess.PIPE,
+                                 text=True).stdout.strip()
+
+    results = []
+    for repo_count in [int(count) for count in args.repos.split(',')]:
+        for org_count in [int(count) for count in args.orgs.split(',')]:
+            work_dir = tempfile.mkdtemp(prefix='jedi_bundle_benchmark_')
+            try:
+                results += run_scenarios(logger, work_dir, repo_count, org_count, args)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = {
+        'environment': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'git': git_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'settings': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w') as output_open:
+        json.dump(output, output_open, indent=2)
+    print(f'Results written to {args.output}')
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    main()
+
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2022 United States Government as represented by the Administrator of the
+# National Aeronautics and Space Administration. All Rights Reserved.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+
+
+import http.server
+import json
+import os
+import socketserver
+import threading
+import time
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    daemon_threads = True
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+class FakeGitHubApi:
+
+    # Local stand-in for the part of api.github.com used to check that a repo exists. A GET of
+    # /repos/<org>/<repo> answers 200 with the full name when root/<org>/<repo> exists and 404
+    # otherwise. An optional latency in seconds is added to each request to mimic the network.
+
+    def __init__(self, root, latency=0.0):
+
+        self.root = root
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        api = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                api.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    # ----------------------------------------------------------------------------------------------
+
+    def url(self):
+
+        return f'http://127.0.0.1:{self.server.server_address[1]}/repos'
+
+    # ----------------------------------------------------------------------------------------------
+
+    def handle(self, request):
+
+        with self.lock:
+            self.requests += 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        parts = request.path.strip('/').split('/')
+        if len(parts) == 3 and parts[0] == 'repos' and \
+                os.path.isdir(os.path.join(self.root, parts[1], parts[2])):
+            status = 200
+            body = json.dumps({'full_name': f'{parts[1]}/{parts[2]}'}).encode('utf-8')
+        else:
+            status = 404
+            body = json.dumps({'message': 'Not Found'}).encode('utf-8')
+
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    # ----------------------------------------------------------------------------------------------
+
+    def __enter__(self):
+
+        self.thread.start()
+        return self
+
+    # ----------------------------------------------------------------------------------------------
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2022 United States Government as represented by the Administrator of the
+# National Aeronautics and Space Administration. All Rights Reserved.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+
+
+import os
+import subprocess
+import tempfile
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def git(command, cwd=None):
+
+    # Run git with a fixed identity so that commits can be made on any machine
+    environment = dict(os.environ)
+    environment.update({
+        'GIT_AUTHOR_NAME': 'jedi_bundle benchmark',
+        'GIT_AUTHOR_EMAIL': 'benchmark@example.com',
+        'GIT_COMMITTER_NAME': 'jedi_bundle benchmark',
+        'GIT_COMMITTER_EMAIL': 'benchmark@example.com',
+    })
+    subprocess.run(['git'] + command, cwd=cwd, env=environment, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def org_name(index):
+
+    return f'fake-org-{index}'
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def repo_name(index):
+
+    return f'fake-repo-{index:04d}'
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def generate_repos(root, repo_count, org_count, files_per_repo=20, user_branch='feature/bench'):
+
+    # Create repo_count bare repos in root/<org>/<repo> spread over org_count organizations. Repo i
+    # lives in organization i % org_count, so resolving it has to probe the organizations before
+    # it. Every repo has a develop branch and every third repo also has the user branch. Returns
+    # the list of repo names and the list of organizations in priority order.
+    orgs = [org_name(index) for index in range(org_count)]
+    repos = [repo_name(index) for index in range(repo_count)]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for index, repo in enumerate(repos):
+
+            bare = os.path.join(root, orgs[index % org_count], repo)
+            os.makedirs(bare)
+            git(['init', '--bare', bare])
+            git(['symbolic-ref', 'HEAD', 'refs/heads/develop'], bare)
+
+            work = os.path.join(work_dir, repo)
+            git(['clone', bare, work])
+            git(['checkout', '-b', 'develop'], work)
+            for file_index in range(files_per_repo):
+                with open(os.path.join(work, f'file_{file_index}.txt'), 'w') as file_open:
+                    file_open.write(f'{repo} {file_index}\n' * 100)
+            git(['add', '.'], work)
+            git(['commit', '-m', 'Initial commit'], work)
+            git(['push', 'origin', 'develop'], work)
+
+            if index % 3 == 0:
+                git(['push', 'origin', f'develop:{user_branch}'], work)
+
+    return repos, orgs
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def push_new_commit(root, org, repo, branch='develop'):
+
+    # Add a commit to a branch of a generated repo, used to time updates that fetch new work
+    with tempfile.TemporaryDirectory() as work:
+        git(['clone', '--branch', branch, os.path.join(root, org, repo), work])
+        with open(os.path.join(work, 'update.txt'), 'a') as file_open:
+            file_open.write('update\n')
+        git(['add', '.'], work)
+        git(['commit', '-m', 'Update'], work)
+        git(['push', 'origin', branch], work)
+
+
+# --------------------------------------------------------------------------------------------------
@@ -11,29 +11,25 @@
 
 import argparse
 import os
-import requests
-import yaml
+import signal
 
-from jedi_bundle.clone_jedi_bundle import clone_jedi
-from jedi_bundle.configure_jedi_bundle import configure_jedi
-from jedi_bundle.make_jedi_bundle import make_jedi
-
-from jedi_bundle.config.config import return_config_path, determine_platform
-from jedi_bundle.utils.file_system import prompt_and_remove_file
-from jedi_bundle.utils.logger import Logger, colors
-from jedi_bundle.utils.yaml import load_yaml
+from jedi_bundle.utils.logger import Logger
+from jedi_bundle.utils.trace import trace_span, tracer
 from jedi_bundle.utils.welcome_message import write_welcome_message
 
+# The stage modules, the configuration modules and their dependencies are imported where they are
+# used so that only what a task needs is loaded, and --help returns right away.
+
 
 # --------------------------------------------------------------------------------------------------
 
 
-def get_default_config():
+def get_default_config(logger):
+
+    from jedi_bundle.config import config_registry, thaw
 
-    internal_config_file = os.path.join(return_config_path(), 'build.yaml')
-    with open(internal_config_file, 'r') as internal_config_file_opened:
-        internal_config_dict = yaml.safe_load(internal_config_file_opened)
-    return internal_config_dict
+    # Mutable copy of the default configuration
+    return thaw(config_registry.get(logger, 'build.yaml'))
 
 
 # --------------------------------------------------------------------------------------------------
@@ -41,6 +37,8 @@ def get_default_config():
 
 def get_bundles():
 
+    from jedi_bundle.config.config import return_config_path
+
     bundles_yaml = os.listdir(os.path.join(return_config_path(), 'bundles'))
     bundles = []
     for bundle_yaml in bundles_yaml:
@@ -61,7 +59,7 @@ def execute_tasks(tasks, config_dict):
     tasks = [task.lower() for task in tasks]
 
     # Check that the options are valid
-    valid_tasks = ['clone', 'configure', 'make', 'all']
+    valid_tasks = ['clone', 'configure', 'make', 'test', 'all']
     for task in tasks:
         if task not in valid_tasks:
             logger.abort(f'Task \'{task}\' not in the valid tasks {valid_tasks}. Ensure the ' +
@@ -71,14 +69,38 @@ def execute_tasks(tasks, config_dict):
     clone_dict = config_dict['clone_options']
     configure_dict = {**clone_dict, **config_dict['configure_options']}
     make_dict = {**configure_dict, **config_dict['make_options']}
+    test_dict = {**make_dict, **config_dict.get('test_options', {})}
+
+    # Commands run with a timeout are in their own process group, Ctrl-C is passed on to them
+    from jedi_bundle.utils.file_system import interrupt_handler
+    signal.signal(signal.SIGINT, interrupt_handler)
+
+    # Trace the run when asked for with the environment
+    trace_pathfile = os.environ.get('JEDI_BUNDLE_TRACE', '')
+    if trace_pathfile != '' and not tracer.enabled():
+        tracer.enable(trace_pathfile)
 
     # Run the build stages
-    if 'all' in tasks or 'clone' in tasks:
-        clone_jedi(logger, clone_dict)
-    if 'all' in tasks or 'configure' in tasks:
-        configure_jedi(logger, configure_dict)
-    if 'all' in tasks or 'make' in tasks:
-        make_jedi(logger, make_dict)
+    try:
+        with trace_span('execute_tasks', 'task', tasks=tasks):
+            if 'all' in tasks or 'clone' in tasks:
+                from jedi_bundle.clone_jedi_bundle import clone_jedi
+                with trace_span('clone_jedi', 'task'):
+                    clone_jedi(logger, clone_dict)
+            if 'all' in tasks or 'configure' in tasks:
+                from jedi_bundle.configure_jedi_bundle import configure_jedi
+                with trace_span('configure_jedi', 'task'):
+                    configure_jedi(logger, configure_dict)
+            if 'all' in tasks or 'make' in tasks:
+                from jedi_bundle.make_jedi_bundle import make_jedi
+                with trace_span('make_jedi', 'task'):
+                    make_jedi(logger, make_dict)
+            if 'test' in tasks:
+                from jedi_bundle.test_jedi_bundle import test_jedi
+                with trace_span('test_jedi', 'task'):
+                    test_jedi(logger, test_dict)
+    finally:
+        tracer.write(logger)
 
 
 # --------------------------------------------------------------------------------------------------
@@ -96,15 +118,35 @@ def jedi_bundle():
                              'and then exit. When two (or more) arguments are passed the final '
                              'argument must be the \npath to the configuration file. The '
                              'proceeding arguments are the choice of task(s) to run.'
-                             '\n\nThe valid tasks are \'Clone\', \'Configure\', \'Build\' and '
-                             '\'All\', where \'All\' runs all of the above. \nTasks names are case '
-                             'insensitive. ' +
+                             '\n\nThe valid tasks are \'Clone\', \'Configure\', \'Build\', '
+                             '\'Test\' and \'All\', where \'All\' runs clone, \nconfigure and '
+                             'build. Tasks names are case insensitive. ' +
                              '\n\nExamples:\n' +
                              '  jedi_bundle                             (Generate config) \n' +
                              '  jedi_bundle All build.yaml              (All tasks) \n' +
                              '  jedi_bundle all build.yaml              (All tasks) \n' +
                              '  jedi_bundle Clone build.yaml            (Clone task) \n'
-                             '  jedi_bundle Clone Configure build.yaml  (Clone & Configure task)\n')
+                             '  jedi_bundle Clone Configure build.yaml  (Clone & Configure task)\n'
+                             '  jedi_bundle Test build.yaml             (Test task) \n')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Ignore cached repository resolution results and query GitHub again.')
+    parser.add_argument('--locked', action='store_true',
+                        help='Clone the exact commits recorded in jedi_bundle.lock.yaml instead of '
+                             'resolving\nbranches across the GitHub organizations.')
+    parser.add_argument('--force', action='store_true',
+                        help='Run configure even when nothing that affects it has changed since '
+                             'the last\nconfigure.')
+    parser.add_argument('--rerun-failed', action='store_true',
+                        help='With the test task only run the tests that failed in the previous '
+                             'run, skipping\nthe bundles where every test passed.')
+    parser.add_argument('--trace', type=str, default=None, metavar='FILE',
+                        help='Write a trace of the run to FILE, which can be opened in '
+                             'chrome://tracing or\nPerfetto. Setting JEDI_BUNDLE_TRACE=FILE does '
+                             'the same.')
+
+    # Parse input string
+    args = parser.parse_args()
+    tasks_and_config = args.tasks_and_config
 
     # Write the welcome message
     write_welcome_message()
@@ -112,16 +154,16 @@ def jedi_bundle():
     # Create the logger
     logger = Logger('JediBundleSetup')
 
-    # Parse input string
-    args = parser.parse_args()
-    tasks_and_config = args.tasks_and_config
-
     # If there are no arguments create build.yaml and exit
     if tasks_and_config == []:
 
+        import yaml
+        from jedi_bundle.config.config import determine_platform
+        from jedi_bundle.utils.file_system import prompt_and_remove_file
+
         # Prepare the configuration from default
         # --------------------------------------
-        internal_config_dict = get_default_config()
+        internal_config_dict = get_default_config(logger)
 
         # Set current directory for source code
         internal_config_dict['clone_options']['path_to_source'] = os.getcwd()
@@ -174,10 +216,24 @@ def jedi_bundle():
         tasks = tasks_and_config[0:-1]
         config_file_name = tasks_and_config[-1]
 
+        from jedi_bundle.utils.yaml import load_yaml
+
         # Read the config
         # ---------------
         config_dict = load_yaml(logger, config_file_name)
 
+        # Command line overrides
+        if args.refresh:
+            config_dict['clone_options']['resolution_cache_refresh'] = True
+        if args.locked:
+            config_dict['clone_options']['locked'] = True
+        if args.force:
+            config_dict['configure_options']['force_configure'] = True
+        if args.rerun_failed:
+            config_dict.setdefault('test_options', {})['rerun_failed'] = True
+        if args.trace is not None:
+            tracer.enable(args.trace)
+
         # Execute the tasks
         # -----------------
         execute_tasks(tasks, config_dict)
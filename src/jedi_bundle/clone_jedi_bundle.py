@@ -9,15 +9,20 @@
 # --------------------------------------------------------------------------------------------------
 
 
-import copy
+import io
 import re
 import os
 
-from jedi_bundle.config.config import return_config_path
+from jedi_bundle.config import config_registry, thaw
+from jedi_bundle.utils.cache import ResolutionCache, user_cache_directory
 from jedi_bundle.utils.config import config_get
-from jedi_bundle.utils.file_system import check_for_executable
-from jedi_bundle.utils.git import get_url_and_branch, clone_git_repo
-from jedi_bundle.utils.yaml import load_yaml
+from jedi_bundle.utils.file_system import check_for_executable, write_file_if_changed
+from jedi_bundle.utils.git import GitHubSession, checkout_git_shas, find_ref_kind, \
+    limit_ls_remote, local_head_sha, pull_lfs_objects_repos, remote_ref_sha, \
+    resolve_and_clone_git_repos
+from jedi_bundle.utils.graph import build_order_dependencies, dependency_closure, \
+    topological_sort
+from jedi_bundle.utils.lock_file import lock_file_path, read_lock_file, write_lock_file
 
 
 # --------------------------------------------------------------------------------------------------
@@ -29,10 +34,41 @@ def clone_jedi(logger, clone_config):
     # ------------
     user_branch = config_get(logger, clone_config, 'user_branch', '')
     github_orgs = config_get(logger, clone_config, 'github_orgs')
+    github_url = config_get(logger, clone_config, 'github_url', 'https://github.com')
+    github_api_url = config_get(logger, clone_config, 'github_api_url',
+                                'https://api.github.com/repos')
     bundles = config_get(logger, clone_config, 'bundles')
     path_to_source = config_get(logger, clone_config, 'path_to_source')
     extra_repos = config_get(logger, clone_config, 'extra_repos')
     crtm_tag_or_branch = config_get(logger, clone_config, 'crtm_tag_or_branch', 'v2.4-jedi.2')
+    resolve_workers = config_get(logger, clone_config, 'resolve_workers', 8)
+    ls_remote_workers = config_get(logger, clone_config, 'ls_remote_workers', 4)
+    clone_workers = config_get(logger, clone_config, 'clone_workers', 4)
+    clone_depth = config_get(logger, clone_config, 'clone_depth', 0)
+    clone_filter = config_get(logger, clone_config, 'clone_filter', '')
+    clone_submodule_jobs = config_get(logger, clone_config, 'clone_submodule_jobs', 4)
+    clone_mirror_dir = config_get(logger, clone_config, 'clone_mirror_dir', '')
+    clone_mirror_mode = config_get(logger, clone_config, 'clone_mirror_mode', 'reference')
+    clone_log_dir = config_get(logger, clone_config, 'clone_log_dir',
+                               os.path.join(path_to_source, 'jedi_bundle_logs'))
+    clone_command_timeout = config_get(logger, clone_config, 'clone_command_timeout', 0)
+    lfs_strategy = config_get(logger, clone_config, 'lfs_strategy', 'inline')
+    lfs_workers = config_get(logger, clone_config, 'lfs_workers', 3)
+    lfs_concurrent_transfers = config_get(logger, clone_config, 'lfs_concurrent_transfers', 8)
+    lfs_include = config_get(logger, clone_config, 'lfs_include', {})
+    lfs_exclude = config_get(logger, clone_config, 'lfs_exclude', {})
+    locked = config_get(logger, clone_config, 'locked', False)
+
+    valid_lfs_strategies = ['inline', 'deferred']
+    if lfs_strategy not in valid_lfs_strategies:
+        logger.abort(f'lfs_strategy \'{lfs_strategy}\' not in the valid strategies ' +
+                     f'{valid_lfs_strategies}.')
+    resolution_cache_dir = config_get(logger, clone_config, 'resolution_cache_dir',
+                                      os.path.join(user_cache_directory(), 'resolution'))
+    resolution_cache_ttl = config_get(logger, clone_config, 'resolution_cache_ttl', 3600)
+    resolution_cache_negative_ttl = config_get(logger, clone_config,
+                                               'resolution_cache_negative_ttl', 300)
+    resolution_cache_refresh = config_get(logger, clone_config, 'resolution_cache_refresh', False)
 
     # Check for needed executables
     # ----------------------------
@@ -43,31 +79,52 @@ def clone_jedi(logger, clone_config):
     # -------------------------------------------
     req_repos_all = []
     opt_repos_all = []
+    lfs_include_bundles = {}
     for bundle in bundles:
 
         # Get dictionary for the bundle
-        bundle_pathfile = os.path.join(return_config_path(), 'bundles', bundle + '.yaml')
-        bundle_dict = load_yaml(logger, bundle_pathfile)
+        bundle_dict = config_registry.get(logger, 'bundles', bundle + '.yaml')
 
         # Repos that need to (can be) be built for this repo
-        req_repos_bun = config_get(logger, bundle_dict, 'required_repos')
-        opt_repos_bun = config_get(logger, bundle_dict, 'optional_repos', [])
+        req_repos_bun = list(config_get(logger, bundle_dict, 'required_repos'))
+        opt_repos_bun = list(config_get(logger, bundle_dict, 'optional_repos', []))
 
         # Append complete list removing duplicates
         req_repos_all = list(set(req_repos_bun + req_repos_all))
         opt_repos_all = list(set(opt_repos_bun + opt_repos_all))
 
+        # LFS files needed by the bundle. A repo needed by any bundle that does not limit the LFS
+        # files gets all its files.
+        lfs_include_bun = config_get(logger, bundle_dict, 'lfs_include', {})
+        for repo in req_repos_bun + opt_repos_bun:
+            if repo not in lfs_include_bun:
+                lfs_include_bundles[repo] = None
+            elif repo not in lfs_include_bundles:
+                lfs_include_bundles[repo] = list(lfs_include_bun[repo])
+            elif lfs_include_bundles[repo] is not None:
+                lfs_include_bundles[repo] += lfs_include_bun[repo]
+
     # Load build order list of dictionaries
     # -------------------------------------
-    build_order_pathfile = os.path.join(return_config_path(), 'bundles', 'build-order.yaml')
-    build_order_dicts = load_yaml(logger, build_order_pathfile)
+    build_order_dicts = list(config_registry.get(logger, 'bundles', 'build-order.yaml'))
+
+    # Session and cache used for all the remote queries, not needed in locked mode
+    # ----------------------------------------------------------------------------
+    lock_pathfile = lock_file_path(path_to_source)
+    if not locked:
+        resolution_cache = ResolutionCache(logger, resolution_cache_dir, resolution_cache_ttl,
+                                           resolution_cache_refresh, resolution_cache_negative_ttl,
+                                           github_url, github_api_url)
+        github_session = GitHubSession(logger, resolve_workers, github_url=github_url,
+                                       github_api_url=github_api_url)
+        limit_ls_remote(ls_remote_workers)
 
     # Adjust CRTM version if necessary
     # --------------------------------
     crtm_index = None
     for index, build_order_dict in enumerate(build_order_dicts):
         if list(build_order_dict.keys())[0] == 'crtm':
-            crtm_dict = copy.copy(build_order_dicts[index])
+            crtm_dict = {'crtm': thaw(build_order_dict['crtm'])}
             break
 
     # Set the crtm tag/branch
@@ -94,14 +151,21 @@ def clone_jedi(logger, clone_config):
         if int(crtm_tag_major) >= 3:
             crtm_dict['crtm']['repo_url_name'] = 'CRTMv3'
 
+    # Confirm from the remote refs whether the crtm version is a tag or a branch. The guess based
+    # on the name is kept if the ref cannot be found, in which case resolution reports the error.
+    if not locked and 'crtm' in req_repos_all + opt_repos_all + extra_repos:
+        crtm_repo_url_name = config_get(logger, crtm_dict['crtm'], 'repo_url_name', 'crtm')
+        crtm_is_tag = find_ref_kind(logger, github_session, github_orgs, crtm_repo_url_name,
+                                    crtm_tag_or_branch, resolution_cache)
+        if crtm_is_tag is not None:
+            crtm_dict['crtm']['tag'] = crtm_is_tag
+
     # Pass dictionary back
     build_order_dicts[index] = crtm_dict
 
-    # Get list of repos in the build order
-    # ------------------------------------
-    build_order_repos = []
-    for build_order_dict in build_order_dicts:
-        build_order_repos.append(list(build_order_dict.keys())[0])
+    # Dependency graph of the repos in the build order
+    # ------------------------------------------------
+    dependencies = build_order_dependencies(logger, build_order_dicts)
 
     # Add extra repos
     # ---------------
@@ -111,24 +175,96 @@ def clone_jedi(logger, clone_config):
     # ----------------------------------------------------------------------------------------
     repos_all = req_repos_all + opt_repos_all
     for repo in repos_all:
-        if repo not in build_order_repos:
+        if repo not in dependencies:
             logger.abort(f'Repository \'{repo}\' not found anywhere in the build order. Make ' +
                          f'sure to add to the build-order.yaml in jedi_bundle.')
 
-    # Remove repos from build order if not needed
-    # -------------------------------------------
-    indices_to_remove = []
-    for index, build_order_dict in enumerate(build_order_dicts):
+    # Add the dependencies of the required and optional repos
+    # -------------------------------------------------------
+    # Everything a required repo depends on is also required. Optional repos bring in their
+    # dependencies as optional repos.
+    req_repos_all = sorted(dependency_closure(logger, dependencies, req_repos_all))
+    opt_repos_all = sorted(dependency_closure(logger, dependencies, opt_repos_all) -
+                           set(req_repos_all))
+
+    # Keep only the needed repos, ordered so that each repo comes after its dependencies
+    # ----------------------------------------------------------------------------------
+    build_order_dict_of_repo = {}
+    for build_order_dict in build_order_dicts:
+        build_order_dict_of_repo[list(build_order_dict.keys())[0]] = build_order_dict
+
+    needed_repos = topological_sort(logger, dependencies, req_repos_all + opt_repos_all)
+    build_order_dicts = [build_order_dict_of_repo[repo] for repo in needed_repos]
+
+    # Gather the information needed to resolve each repo
+    # --------------------------------------------------
+    repos = []
+    repo_dicts = []
+    resolve_list = []
+    for build_order_dict in build_order_dicts:
+
         repo = list(build_order_dict.keys())[0]
-        if repo not in req_repos_all and repo not in opt_repos_all:
-            indices_to_remove.append(index)
 
-    indices_to_remove.reverse()
-    for index_to_remove in indices_to_remove:
-        del build_order_dicts[index_to_remove]
+        # Extract repo information
+        repo_dict = build_order_dict[repo]
+        repo_url_name = config_get(logger, repo_dict, 'repo_url_name', repo)
+        default_branch = config_get(logger, repo_dict, 'default_branch')
+        is_tag_in = config_get(logger, repo_dict, 'tag', False)
+
+        repos.append(repo)
+        repo_dicts.append(repo_dict)
+        resolve_list.append((repo_url_name, default_branch, is_tag_in))
+
+    # Shallow, partial and mirror clone settings
+    # ------------------------------------------
+    clone_settings = {
+        'depth': clone_depth,
+        'filter': clone_filter,
+        'submodule_jobs': clone_submodule_jobs,
+        'mirror_dir': clone_mirror_dir,
+        'mirror_mode': clone_mirror_mode,
+        'lfs_strategy': lfs_strategy,
+        'log_dir': clone_log_dir,
+        'command_timeout': clone_command_timeout,
+    }
+
+    # Take url and branch of all repos from the lock file or resolve them, cloning as they resolve
+    # --------------------------------------------------------------------------------------------
+    if locked:
+
+        logger.info(f'Using the repositories and commits recorded in {lock_pathfile}.')
+        lock_entries = read_lock_file(logger, lock_pathfile)
+        resolved = []
+        for repo in repos:
+            if repo in lock_entries:
+                lock_entry = lock_entries[repo]
+                resolved.append((True, lock_entry['url'], lock_entry['ref'], lock_entry['tag']))
+            else:
+                resolved.append((False, '', '', False))
 
-    # Loop through build order and clone repo
-    # ---------------------------------------
+    else:
+
+        # Special treatment for jedicmake since it is typically part of spack
+        targets = [os.path.join(path_to_source, repo) for repo in repos]
+        clone_flags = [repo != 'jedicmake' for repo in repos]
+        required_flags = [repo in req_repos_all for repo in repos]
+
+        logger.info(f'Resolving {len(repos)} repositories across {len(github_orgs)} ' +
+                    f'organizations and cloning them as they are resolved, with up to ' +
+                    f'{resolve_workers} API requests, {ls_remote_workers} ls-remote calls and ' +
+                    f'{clone_workers} clones at a time.')
+        resolved, resolved_clone_statuses = resolve_and_clone_git_repos(
+            logger, github_session, github_orgs, repos, resolve_list, user_branch, targets,
+            clone_flags, required_flags, resolve_workers + ls_remote_workers, clone_workers,
+            clone_settings, resolution_cache)
+        github_session.close()
+        if resolution_cache.enabled:
+            logger.info(f'Resolution cache {resolution_cache_dir} answered ' +
+                        f'{resolution_cache.hits} of ' +
+                        f'{resolution_cache.hits + resolution_cache.misses} lookups.')
+
+    # Loop through build order and collect the repos to clone
+    # -------------------------------------------------------
     repo_list = []
     url_list = []
     branch_list = []
@@ -138,20 +274,10 @@ def clone_jedi(logger, clone_config):
 
     optional_repos_not_found = []
 
-    for index, build_order_dict in enumerate(build_order_dicts):
-
-        repo = list(build_order_dict.keys())[0]
+    for repo, repo_dict, (found, url, branch, is_tag) in zip(repos, repo_dicts, resolved):
 
-        # Extract repo information
-        repo_dict = build_order_dict[repo]
-        repo_url_name = config_get(logger, repo_dict, 'repo_url_name', repo)
-        default_branch = config_get(logger, repo_dict, 'default_branch')
         cmakelists = config_get(logger, repo_dict, 'cmakelists', '')
         recursive = config_get(logger, repo_dict, 'recursive', False)
-        is_tag_in = config_get(logger, repo_dict, 'tag', False)
-
-        found, url, branch, is_tag = get_url_and_branch(logger, github_orgs, repo_url_name,
-                                                        default_branch, user_branch, is_tag_in)
 
         if found:
 
@@ -165,14 +291,17 @@ def clone_jedi(logger, clone_config):
 
         else:
 
-            if repo in req_repos_all:
+            if repo in req_repos_all and locked:
+                logger.abort(f'Repo \'{repo}\' is required but not found in the lock file ' +
+                             f'{lock_pathfile}.')
+            elif repo in req_repos_all:
                 logger.abort(f'No matching branch for repo \'{repo}\' was found in any ' +
                              f'organisations.')
             else:
                 optional_repos_not_found.append(repo)
 
-    # Write out information about clone
-    # ---------------------------------
+    # Write out information about the repos in build order
+    # ----------------------------------------------------
     repo_len = len(max(repo_list, key=len))
     url_len = len(max(url_list, key=len))
     branch_len = len(max(branch_list, key=len))
@@ -185,7 +314,7 @@ def clone_jedi(logger, clone_config):
         if is_tag:
             branch_or_tag = 'Tag'
         logger.info(f'{branch_or_tag.ljust(6)} {branch.ljust(branch_len)} of ' +
-                    f'{repo.ljust(repo_len)} will be cloned from {url.ljust(url_len)}')
+                    f'{repo.ljust(repo_len)} from {url.ljust(url_len)}')
 
     if optional_repos_not_found:
         logger.info(f' ')
@@ -194,8 +323,14 @@ def clone_jedi(logger, clone_config):
             logger.info(f' {optional_repo_not_found}')
     logger.info(f'-------------------------')
 
-    # Do the cloning
-    # --------------
+    # Repos that are cloned
+    # ---------------------
+    clone_repos = []
+    clone_urls = []
+    clone_branches = []
+    clone_targets = []
+    clone_is_tags = []
+    clone_statuses = []
     for repo, url, branch, is_tag in zip(repo_list, url_list, branch_list, is_tag_list):
 
         # Special treatment for jedicmake since it is typically part of spack.
@@ -203,13 +338,70 @@ def clone_jedi(logger, clone_config):
             logger.info(f'Skipping explicit clone of \'{repo}\' since it\'s usually a module. ' +
                         f'If it\'s not a module it will be cloned at configure time.')
         else:
-            logger.info(f'Cloning \'{repo}\'.')
-            clone_git_repo(logger, url, branch, os.path.join(path_to_source, repo), is_tag)
+            clone_repos.append(repo)
+            clone_urls.append(url)
+            clone_branches.append(branch)
+            clone_targets.append(os.path.join(path_to_source, repo))
+            clone_is_tags.append(is_tag)
+            if not locked:
+                clone_statuses.append(resolved_clone_statuses[repos.index(repo)])
+
+    if locked:
+
+        # Fetch the exact commits recorded in the lock file
+        clone_shas = [lock_entries[repo]['sha'] for repo in clone_repos]
+        logger.info(f'Checking out {len(clone_repos)} locked repositories using {clone_workers} ' +
+                    f'workers.')
+        clone_statuses = checkout_git_shas(logger, clone_repos, clone_urls, clone_branches,
+                                           clone_targets, clone_is_tags, clone_shas, clone_workers,
+                                           clone_settings)
+
+    # Download the LFS objects that were skipped during the clone
+    # -----------------------------------------------------------
+    if lfs_strategy == 'deferred':
+
+        # Patterns set by the user take precedence over those from the bundles
+        lfs_includes = {}
+        for repo, patterns in lfs_include_bundles.items():
+            if patterns is not None:
+                lfs_includes[repo] = patterns
+        lfs_includes.update(lfs_include)
+
+        logger.info(f'Pulling LFS objects using {lfs_workers} workers with ' +
+                    f'{lfs_concurrent_transfers} concurrent transfers each.')
+        pull_lfs_objects_repos(logger, clone_repos, clone_targets, lfs_workers,
+                               lfs_concurrent_transfers, lfs_includes, lfs_exclude,
+                               clone_settings)
+
+    # Record the commit of each repo in the lock file
+    # -----------------------------------------------
+    if not locked:
+        sha_list = []
+        for repo, url, branch, is_tag in zip(repo_list, url_list, branch_list, is_tag_list):
+            if repo in clone_repos:
+                sha_list.append(local_head_sha(logger, os.path.join(path_to_source, repo)))
+            else:
+                sha = remote_ref_sha(logger, url, branch, is_tag)
+                if sha is None:
+                    logger.info(f'The commit of \'{repo}\' could not be found on the remote, it ' +
+                                f'is not pinned in the lock file.')
+                sha_list.append(sha or '')
+        write_lock_file(logger, lock_pathfile, repo_list, url_list, branch_list, is_tag_list,
+                        sha_list)
+
+    # Write out the status of each repo
+    # ---------------------------------
+    if clone_repos:
+        repo_len = len(max(clone_repos, key=len))
+        logger.info(f'Repository status summary:')
+        logger.info(f'--------------------------')
+        for repo, clone_status in zip(clone_repos, clone_statuses):
+            logger.info(f'{repo.ljust(repo_len)} {clone_status}')
+        logger.info(f'--------------------------')
 
     # Create CMakeLists.txt file
     # --------------------------
-    cmake_pathfile = os.path.join(return_config_path(), 'cmake.yaml')
-    cmake_dict = load_yaml(logger, cmake_pathfile)
+    cmake_dict = config_registry.get(logger, 'cmake.yaml')
 
     cmake_header_lines = cmake_dict['header']
     cmake_footer_lines = cmake_dict['footer']
@@ -221,11 +413,9 @@ def clone_jedi(logger, clone_config):
     url_len = len(max(url_list, key=len))+2  # Plus 2 because of the quotes
     branch_len = len(max(branch_list, key=len))
 
-    # Remove file if it exists
-    if os.path.exists(output_file):
-        os.remove(output_file)
-
-    with open(output_file, 'a') as output_file_open:
+    # Build the file in memory and only replace it when it changes so that CMake does not
+    # regenerate the whole tree
+    with io.StringIO() as output_file_open:
         for cmake_header_line in cmake_header_lines:
             output_file_open.write(cmake_header_line + '\n')
 
@@ -278,5 +468,7 @@ def clone_jedi(logger, clone_config):
         for cmake_footer_line in cmake_footer_lines:
             output_file_open.write(cmake_footer_line + '\n')
 
+        write_file_if_changed(logger, output_file, output_file_open.getvalue())
+
 
 # --------------------------------------------------------------------------------------------------
@@ -7,3 +7,5 @@
 import os
 
 config_directory = os.path.dirname(__file__)
+
+from jedi_bundle.config.config import config_registry, thaw  # noqa: E402
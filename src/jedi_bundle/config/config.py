@@ -8,10 +8,19 @@
 # --------------------------------------------------------------------------------------------------
 
 
+import concurrent.futures
+import hashlib
+import json
 import os
+import signal
+import socket
 import subprocess
-import yaml
+import threading
+import types
 
+from jedi_bundle.utils.cache import make_shared_directory, user_cache_directory, \
+    write_json_atomic
+from jedi_bundle.utils.trace import traced
 from jedi_bundle.utils.yaml import load_yaml
 
 
@@ -25,7 +34,68 @@ def return_config_path():
 # --------------------------------------------------------------------------------------------------
 
 
-def determine_platform(logger):
+def freeze(value):
+
+    # Read only view of a parsed yaml value, dictionaries become mapping proxies and lists become
+    # tuples
+    if isinstance(value, dict):
+        return types.MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def thaw(value):
+
+    # Mutable copy of a frozen value
+    if isinstance(value, types.MappingProxyType):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+class ConfigRegistry:
+
+    # The configuration files shipped with the package, each parsed once per process. The values
+    # are shared so they are returned as read only views, use thaw to get a copy to modify.
+
+    def __init__(self):
+
+        self.configs = {}
+        self.lock = threading.Lock()
+
+    # ----------------------------------------------------------------------------------------------
+
+    def get(self, logger, *path):
+
+        # Path of the file relative to the config directory, e.g. 'bundles', 'oops.yaml'
+        relative_pathfile = os.path.join(*path)
+
+        with self.lock:
+            if relative_pathfile not in self.configs:
+                pathfile = os.path.join(return_config_path(), relative_pathfile)
+                self.configs[relative_pathfile] = freeze(load_yaml(logger, pathfile))
+
+            return self.configs[relative_pathfile]
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+config_registry = ConfigRegistry()
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def platform_pathfiles():
 
     # Get the supported platforms
     possible_platforms = os.listdir(os.path.join(return_config_path(), 'platforms'))
@@ -33,57 +103,141 @@ def determine_platform(logger):
     # Remove anything that does not start with a character (avoid system files)
     possible_platforms = [platform for platform in possible_platforms if platform[0].isalnum()]
 
-    # Loop over possible platforms
-    for platform in possible_platforms:
-
-        # Open the dictionary
-        platform_dict = load_yaml(logger, os.path.join(return_config_path(), 'platforms', platform))
+    return [os.path.join(return_config_path(), 'platforms', platform)
+            for platform in sorted(possible_platforms)]
 
-        # List of commands to check if this is the platform
-        is_it_me = platform_dict['is_it_me']
 
-        # Loop over commands
-        for is_it_me_command in is_it_me:
+# --------------------------------------------------------------------------------------------------
 
-            # Run command_in in shell and get return
-            command_out = subprocess.run(is_it_me_command['command'], shell=True,
-                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                         text=True)
 
-            # If command_out is not in command_out_actual go to next platform
-            if is_it_me_command['contains'] not in command_out.stdout:
-                break
+def platform_cache_key(pathfiles):
 
-        # If we made it here all commands were successful for this platform
-        return platform_dict['platform_name'], platform_dict['modules']['default_modules']
+    # The cached platform is only valid for this host and this exact set of platform files
+    key = hashlib.sha1(socket.gethostname().encode('utf-8'))
+    for pathfile in pathfiles:
+        pathfile_stat = os.stat(pathfile)
+        key.update(f'{pathfile}:{pathfile_stat.st_mtime_ns}:{pathfile_stat.st_size}'.encode())
 
-    # If we made it here no matching platform identified
-    return None, None
+    return key.hexdigest()
 
 
 # --------------------------------------------------------------------------------------------------
 
 
-def check_platform(platform):
+@traced('platform', 'command')
+def run_probe(command, timeout):
 
-    # Get the supported platforms
-    possible_configs = os.listdir(os.path.join(return_config_path(), 'platforms'))
+    # Run command in shell and get the output. The command runs in its own process group so that
+    # everything it started can be killed when it hangs. A probe that fails to run or hangs
+    # returns None.
+    try:
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, text=True, start_new_session=True)
+    except Exception:
+        return None
 
-    # Remove anything that does not start with a character (avoid system files)
-    possible_configs = [platform for platform in possible_configs if platform[0].isalnum()]
+    try:
+        command_out, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.communicate()
+        return None
+
+    return command_out
+
+
+# --------------------------------------------------------------------------------------------------
 
-    # List of possible platforms
-    possible_platforms = []
 
-    # Loop over possible platforms
-    for possible_config in possible_configs:
+def determine_platform(logger, probe_timeout=10):
+
+    pathfiles = platform_pathfiles()
+
+    # The platform found previously on this host. Only platforms that were found are cached
+    # (entries written by earlier versions may not have one).
+    cache_pathfile = os.path.join(user_cache_directory(), 'platform',
+                                  socket.gethostname() + '.json')
+    cache_key = platform_cache_key(pathfiles)
+    try:
+        with open(cache_pathfile, 'r') as cache_file:
+            cache_entry = json.load(cache_file)
+        if cache_entry['key'] == cache_key and cache_entry['platform'] is not None:
+            return cache_entry['platform'], cache_entry['modules']
+    except Exception:
+        pass
+
+    # Open the dictionaries
+    platform_dicts = [config_registry.get(logger, 'platforms', os.path.basename(pathfile))
+                      for pathfile in pathfiles]
+
+    # Each distinct command is only run once even when several platforms use it
+    commands = []
+    for platform_dict in platform_dicts:
+        for is_it_me_command in platform_dict['is_it_me']:
+            if is_it_me_command['command'] not in commands:
+                commands.append(is_it_me_command['command'])
+
+    # A platform matches once the output of each of its commands contains the expected string
+    def platform_match(platform_dict, outputs):
+        for is_it_me_command in platform_dict['is_it_me']:
+            command_out = outputs.get(is_it_me_command['command'])
+            if command_out is None or is_it_me_command['contains'] not in command_out:
+                return False
+        return True
+
+    # Run all the commands at the same time and stop at the first platform that fully matches
+    platform = None
+    modules = None
+    outputs = {}
+    probe_failed = False
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(commands)))
+    futures = {executor.submit(run_probe, command, probe_timeout): command for command in commands}
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            command_out = future.result()
+        except Exception:
+            command_out = None
+        if command_out is None:
+            probe_failed = True
+        else:
+            outputs[futures[future]] = command_out
+
+        matched_dicts = [platform_dict for platform_dict in platform_dicts
+                         if platform_match(platform_dict, outputs)]
+        if matched_dicts:
+            platform = matched_dicts[0]['platform_name']
+            modules = matched_dicts[0]['modules']['default_modules']
+            break
+
+    # Probes that are still running are left to time out in the background
+    for future in futures:
+        future.cancel()
+    executor.shutdown(wait=False)
+
+    # Remember the result for this host, unless it could have been different had every probe
+    # answered
+    if platform is None or probe_failed:
+        return platform, modules
+
+    try:
+        make_shared_directory(os.path.dirname(cache_pathfile))
+        write_json_atomic(cache_pathfile, {'key': cache_key, 'platform': platform,
+                                           'modules': modules})
+    except Exception as e:
+        logger.trace(f'Failed to write the platform cache {cache_pathfile}: {e}')
+
+    return platform, modules
 
-        # Open the dictionary
-        possible_config_path = os.path.join(return_config_path(), 'platforms', possible_config)
-        with open(possible_config_path, 'r') as possible_config_opened:
-            possible_dict = yaml.safe_load(possible_config_opened)
 
-        # Append list
+# --------------------------------------------------------------------------------------------------
+
+
+def check_platform(logger, platform):
+
+    # List of possible platforms
+    possible_platforms = []
+    for pathfile in platform_pathfiles():
+        possible_dict = config_registry.get(logger, 'platforms', os.path.basename(pathfile))
         possible_platforms.append(possible_dict['platform_name'])
 
     # Check if platform is in possible platforms
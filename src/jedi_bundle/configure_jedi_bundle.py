@@ -9,13 +9,112 @@
 # --------------------------------------------------------------------------------------------------
 
 
+import hashlib
+import io
+import json
 import os
-import subprocess
 
+from jedi_bundle.config import config_registry
 from jedi_bundle.config.config import return_config_path
+from jedi_bundle.utils.build_log import BuildProgress, failure_report
+from jedi_bundle.utils.compiler_cache import compiler_cache_settings, \
+    compiler_launcher_directives
 from jedi_bundle.utils.config import config_get
-from jedi_bundle.utils.file_system import remove_file
-from jedi_bundle.utils.yaml import load_yaml
+from jedi_bundle.utils.file_system import remove_file, subprocess_run, write_file_if_changed
+from jedi_bundle.utils.git import local_head_sha
+from jedi_bundle.utils.trace import trace_span
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def generator_directives(logger, generator, compile_pool_size, link_pool_size):
+
+    if generator == 'make':
+        if compile_pool_size > 0 or link_pool_size > 0:
+            logger.info(f'The compile and link pool sizes only apply to the ninja generator.')
+        return ''
+
+    # Ninja job pools limit how many compile and link steps run at once. Linking the large test
+    # executables uses a lot of memory so the link pool is usually the smaller one.
+    pools = []
+    directives = '-G Ninja '
+    if compile_pool_size > 0:
+        pools.append(f'compile={compile_pool_size}')
+        directives = directives + '-DCMAKE_JOB_POOL_COMPILE=compile '
+    if link_pool_size > 0:
+        pools.append(f'link={link_pool_size}')
+        directives = directives + '-DCMAKE_JOB_POOL_LINK=link '
+    if pools:
+        directives = directives + f'-DCMAKE_JOB_POOLS="{";".join(pools)}" '
+
+    return directives
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def file_digest(pathfile):
+
+    # Digest of the content of a file, empty when the file does not exist
+    if pathfile is None or not os.path.exists(pathfile):
+        return ''
+
+    with open(pathfile, 'rb') as pathfile_open:
+        return hashlib.sha256(pathfile_open.read()).hexdigest()
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def repository_shas(logger, path_to_source):
+
+    # The repos in the source directory, identified by the commit they have checked out
+    repo_shas = {}
+    for repo in sorted(os.listdir(path_to_source)):
+        repo_path = os.path.join(path_to_source, repo)
+        if os.path.exists(os.path.join(repo_path, '.git')):
+            repo_shas[repo] = local_head_sha(logger, repo_path)
+
+    return repo_shas
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def configure_fingerprint(logger, ecbuild, path_to_source, pathfiles):
+
+    # Everything that changes the outcome of configure
+    fingerprint = {
+        'ecbuild command': ecbuild,
+        'repositories': repository_shas(logger, path_to_source),
+    }
+    for name, pathfile in pathfiles.items():
+        fingerprint[name] = file_digest(pathfile)
+
+    return fingerprint
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def configure_is_up_to_date(logger, path_to_build, fingerprint_file, fingerprint):
+
+    # The previous configure must have completed and its fingerprint must match
+    if not os.path.exists(os.path.join(path_to_build, 'CMakeCache.txt')):
+        return False
+
+    try:
+        with open(fingerprint_file, 'r') as fingerprint_file_open:
+            previous_fingerprint = json.load(fingerprint_file_open)
+    except Exception:
+        return False
+
+    changed = [name for name in fingerprint if fingerprint[name] != previous_fingerprint.get(name)]
+    if changed:
+        logger.info(f'Configure inputs changed since the last configure: {changed}')
+
+    return not changed
 
 
 # --------------------------------------------------------------------------------------------------
@@ -31,6 +130,19 @@ def configure_jedi(logger, configure_config):
     path_to_build = config_get(logger, configure_config, 'path_to_build')
     custom_configure_options = config_get(logger, configure_config, 'custom_configure_options', '')
     external_modules = config_get(logger, configure_config, 'external_modules', False)
+    generator = config_get(logger, configure_config, 'generator', 'make')
+    compile_pool_size = config_get(logger, configure_config, 'compile_pool_size', 0)
+    link_pool_size = config_get(logger, configure_config, 'link_pool_size', 0)
+    force_configure = config_get(logger, configure_config, 'force_configure', False)
+    failure_tail_lines = config_get(logger, configure_config, 'failure_tail_lines', 40)
+
+    compiler_cache, compiler_cache_dir, compiler_cache_max_size = \
+        compiler_cache_settings(logger, configure_config)
+
+    # Check the generator
+    valid_generators = ['make', 'ninja']
+    if generator not in valid_generators:
+        logger.abort(f'The generator \'{generator}\' is not one of {valid_generators}.')
 
     # Create build directory
     os.makedirs(path_to_build, exist_ok=True)
@@ -38,9 +150,12 @@ def configure_jedi(logger, configure_config):
 
     # Open platform dictionary
     platform_configure_directives = ''
+    platform_pathfile = None
+    modules_init = None
+    modules_file = None
     if platform != 'none':
         platform_pathfile = os.path.join(return_config_path(), 'platforms', platform + '.yaml')
-        platform_dict = load_yaml(logger, platform_pathfile)
+        platform_dict = config_registry.get(logger, 'platforms', platform + '.yaml')
 
         if not external_modules:
 
@@ -51,18 +166,18 @@ def configure_jedi(logger, configure_config):
             # Create modules init file
             module_inits = config_get(logger, modules_dict, 'init', [])
             modules_init = os.path.join(path_to_build, 'modules-init')
-            remove_file(logger, modules_init)
-            with open(modules_init, 'a') as modules_init_open:
+            with io.StringIO() as modules_init_open:
                 for module_init in module_inits:
                     modules_init_open.write(module_init + '\n')
+                write_file_if_changed(logger, modules_init, modules_init_open.getvalue())
 
             # Create modules file
             module_directives = config_get(logger, modules_dict, 'load')
             modules_file = os.path.join(path_to_build, 'modules')
-            remove_file(logger, modules_file)
-            with open(modules_file, 'a') as modules_file_open:
+            with io.StringIO() as modules_file_open:
                 for module_directive in module_directives:
                     modules_file_open.write(module_directive + '\n')
+                write_file_if_changed(logger, modules_file, modules_file_open.getvalue())
 
         # Link in CRTM coefficients to source directory to avoid download
         crtm_coefficient_path_platform = platform_dict['crtm_coeffs_path']
@@ -78,36 +193,77 @@ def configure_jedi(logger, configure_config):
 
     # File to hold configure steps
     configure_file = os.path.join(path_to_build, 'jedi_bundle_configure.sh')
-    remove_file(logger, configure_file)
 
     # ecbuild command
-    ecbuild = f'ecbuild --build={cmake_build_type} {platform_configure_directives} ' + \
+    generator_configure_directives = generator_directives(logger, generator, compile_pool_size,
+                                                          link_pool_size)
+    if compiler_cache is not None:
+        os.makedirs(compiler_cache_dir, exist_ok=True)
+        generator_configure_directives = generator_configure_directives + \
+            compiler_launcher_directives(compiler_cache)
+    ecbuild = f'ecbuild --build={cmake_build_type} {generator_configure_directives}' + \
+              f'{platform_configure_directives} ' + \
               f'{custom_configure_options} -DENABLE_IODA_DATA=ON -DENABLE_UFO_DATA=ON ' + \
               f'-DENABLE_FV3_JEDI_DATA=ON {path_to_source}'
     logger.info(f'Running configure with \'{ecbuild}\'')
 
     # Write steps to file
-    with open(configure_file, 'a') as configure_file_open:
+    with io.StringIO() as configure_file_open:
         configure_file_open.write(f'#!/usr/bin/env bash \n')
         configure_file_open.write(f'\n')
-        if not external_modules:
+        if modules_init is not None:
             configure_file_open.write(f'source {modules_init}\n')
             configure_file_open.write(f'source {modules_file}\n')
         configure_file_open.write(f'\n')
+        if compiler_cache is not None:
+            configure_file_open.write(f'export CCACHE_DIR={compiler_cache_dir} \n')
+            configure_file_open.write(f'{compiler_cache} --max-size={compiler_cache_max_size} \n')
+            configure_file_open.write(f'\n')
         configure_file_open.write(f'{ecbuild} \n')
 
-    # Make file executable
-    os.chmod(configure_file, 0o755)
+        # Write the executable file
+        write_file_if_changed(logger, configure_file, configure_file_open.getvalue(), 0o755)
+
+    # Skip configure when nothing that affects it has changed
+    fingerprint_file = os.path.join(path_to_build, 'jedi_bundle_configure.fingerprint')
+    fingerprint = configure_fingerprint(logger, ecbuild, path_to_source, {
+        'CMakeLists.txt': os.path.join(path_to_source, 'CMakeLists.txt'),
+        'modules-init': modules_init,
+        'modules': modules_file,
+        'configure script': configure_file,
+        'platform': platform_pathfile,
+    })
+
+    if not force_configure and \
+            configure_is_up_to_date(logger, path_to_build, fingerprint_file, fingerprint):
+        logger.info(f'Nothing that affects configure has changed since the last configure, ' +
+                    f'skipping. Pass --force to configure anyway.')
+        return
+
+    # A failed configure must not leave the previous fingerprint behind
+    remove_file(logger, fingerprint_file)
+
+    # Run configure with its output going to a log and only errors shown on the console
+    configure_log = os.path.join(path_to_build, 'jedi_bundle_configure.log')
+    remove_file(logger, configure_log)
+
+    progress = BuildProgress(logger)
+    progress.start('configure')
+    with trace_span('ecbuild', 'subprocess', command=ecbuild):
+        result = subprocess_run(logger, ['./jedi_bundle_configure.sh'], False, cwd=path_to_build,
+                                log_pathfile=configure_log, tail_lines=failure_tail_lines,
+                                line_callback=lambda line: progress.update('configure', line))
+    progress.finish('configure')
 
-    # Configure command
-    configure = [f'./jedi_bundle_configure.sh']
+    if result.returncode != 0:
+        logger.abort(failure_report('Configure', result, progress.first_error('configure')))
+    logger.info(f'Configure finished in {result.duration:.1f}s, the output is in {configure_log}')
 
-    # Run command
-    cwd = os.getcwd()
-    os.chdir(path_to_build)
-    process = subprocess.run(configure)
-    logger.assert_abort(process.returncode == 0, f'Configure failed.')
-    os.chdir(cwd)
+    # Record what this configure was run with. Configure clones (e.g. jedicmake) and updates
+    # repos in the source directory so the repos are taken as they are after configure.
+    fingerprint['repositories'] = repository_shas(logger, path_to_source)
+    with open(fingerprint_file, 'w') as fingerprint_file_open:
+        json.dump(fingerprint, fingerprint_file_open, indent=2)
 
 
 # --------------------------------------------------------------------------------------------------
@@ -9,11 +9,90 @@
 # --------------------------------------------------------------------------------------------------
 
 
+import io
 import os
-import subprocess
 
+from jedi_bundle.config import config_registry
+from jedi_bundle.utils.build_log import BuildProgress, failure_report
+from jedi_bundle.utils.compiler_cache import compiler_cache_environment, \
+    compiler_cache_settings, read_compiler_cache_stats
 from jedi_bundle.utils.config import config_get
-from jedi_bundle.utils.file_system import remove_file
+from jedi_bundle.utils.file_system import remove_file, subprocess_run, write_file_if_changed
+from jedi_bundle.utils.graph import build_order_dependencies, bundle_waits
+from jedi_bundle.utils.jobserver import Jobserver
+from jedi_bundle.utils.parallel import run_dependent_tasks
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def write_make_script(logger, path_to_build, bundle, bundle_dir, external_modules, generator,
+                      cores_to_use_for_make, environment):
+
+    # With ninja the bundle directory only holds what the bundle generates
+    os.makedirs(bundle_dir, exist_ok=True)
+
+    make_file = os.path.join(bundle_dir, 'jedi_bundle_make.sh')
+
+    # Write steps to file. Ninja builds the bundle's directory target from the top of the build
+    # tree. When started by jedi_bundle make joins the shared jobserver, when the script is run by
+    # hand it uses its own job count.
+    with io.StringIO() as make_file_open:
+        make_file_open.write(f'#!/usr/bin/env bash \n')
+        make_file_open.write(f'\n')
+        if not external_modules:
+            modules_init = os.path.join(path_to_build, 'modules-init')
+            make_file_open.write(f'source {modules_init} \n')
+            modules_load = os.path.join(path_to_build, 'modules')
+            make_file_open.write(f'source {modules_load} \n')
+        make_file_open.write(f'\n')
+        if environment:
+            for variable, value in environment.items():
+                make_file_open.write(f'export {variable}={value} \n')
+            make_file_open.write(f'\n')
+        if generator == 'ninja':
+            make_file_open.write(f'ninja -C {path_to_build} -j{cores_to_use_for_make} ' +
+                                 f'{bundle}/all \n')
+        else:
+            make_file_open.write(f'if [[ "$MAKEFLAGS" == *jobserver* ]]; then \n')
+            make_file_open.write(f'  make \n')
+            make_file_open.write(f'else \n')
+            make_file_open.write(f'  make -j{cores_to_use_for_make} \n')
+            make_file_open.write(f'fi \n')
+
+        # Write the executable file
+        write_file_if_changed(logger, make_file, make_file_open.getvalue(), 0o755)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def make_bundle(logger, bundle, bundle_dir, jobserver, progress, failure_tail_lines):
+
+    progress.info(f'Started building the {bundle} bundle')
+
+    # Output of each bundle goes to its own log since several bundles build at the same time. The
+    # console only shows the progress and, on failure, the first error and the last lines.
+    make_log = os.path.join(bundle_dir, 'jedi_bundle_make.log')
+    remove_file(logger, make_log)
+
+    progress.start(bundle)
+    try:
+        # subprocess_run records the span of the make, with the bundle directory as attribute
+        result = subprocess_run(logger, ['./jedi_bundle_make.sh'], False, cwd=bundle_dir,
+                                log_pathfile=make_log, tail_lines=failure_tail_lines,
+                                env=jobserver.environment(), pass_fds=jobserver.fds(),
+                                line_callback=lambda line: progress.update(bundle, line))
+    finally:
+        progress.finish(bundle)
+
+    if result.returncode == 0:
+        progress.info(f'Finished building the {bundle} bundle in {result.duration:.1f}s')
+    else:
+        progress.info(failure_report(f'Make for the {bundle} bundle', result,
+                                     progress.first_error(bundle)))
+
+    return result.returncode == 0
 
 
 # --------------------------------------------------------------------------------------------------
@@ -27,41 +106,85 @@ def make_jedi(logger, make_config):
     path_to_build = config_get(logger, make_config, 'path_to_build')
     external_modules = config_get(logger, make_config, 'external_modules', False)
     cores_to_use_for_make = config_get(logger, make_config, 'cores_to_use_for_make')
-
-    # File to hold configure steps
+    bundles_in_parallel = config_get(logger, make_config, 'bundles_in_parallel', 4)
+    generator = config_get(logger, make_config, 'generator', 'make')
+    path_to_source = config_get(logger, make_config, 'path_to_source')
+    failure_tail_lines = config_get(logger, make_config, 'failure_tail_lines', 40)
+    compiler_cache, compiler_cache_dir, _ = compiler_cache_settings(logger, make_config)
+
+    # Bundles that share repos that are not yet built cannot be built at the same time
+    # --------------------------------------------------------------------------------
+    build_order_dicts = config_registry.get(logger, 'bundles', 'build-order.yaml')
+    dependencies = build_order_dependencies(logger, build_order_dicts)
+    bundles, waits = bundle_waits(logger, dependencies, bundles)
+
+    bundles_in_parallel = max(1, min(bundles_in_parallel, len(bundles), cores_to_use_for_make))
+
+    # Ninja keeps its state in the top of the build tree so only one ninja can run there at a time.
+    # Each bundle uses all the cores instead.
+    if generator == 'ninja':
+        bundles_in_parallel = 1
+
+    logger.info(f'')
+    logger.info(f'Building the bundles {bundles} using {cores_to_use_for_make} cores, with up to ' +
+                f'{bundles_in_parallel} bundles at a time')
+    logger.info(f'')
+
+    # Write the make script of each bundle
+    # ------------------------------------
+    bundle_dirs = []
     for bundle in bundles:
-
-        logger.info(f'')
-        logger.info(f'Building the {bundle} bundle using {cores_to_use_for_make} cores')
-        logger.info(f'')
-
         bundle_dir = os.path.join(path_to_build, bundle)
 
-        make_file = os.path.join(bundle_dir, 'jedi_bundle_make.sh')
-        remove_file(logger, make_file)
-
-        # Write steps to file
-        with open(make_file, 'a') as make_file_open:
-            make_file_open.write(f'#!/usr/bin/env bash \n')
-            make_file_open.write(f'\n')
-            if not external_modules:
-                modules_init = os.path.join(path_to_build, 'modules-init')
-                make_file_open.write(f'source {modules_init} \n')
-                modules_load = os.path.join(path_to_build, 'modules')
-                make_file_open.write(f'source {modules_load} \n')
-            make_file_open.write(f'\n')
-            make_file_open.write(f'make -j{cores_to_use_for_make} \n')
+        # Each bundle records its own compiler cache statistics
+        environment = {}
+        if compiler_cache is not None:
+            stats_log = os.path.join(bundle_dir, 'jedi_bundle_ccache_stats.log')
+            remove_file(logger, stats_log)
+            environment = compiler_cache_environment(compiler_cache_dir, path_to_source, stats_log)
+
+        write_make_script(logger, path_to_build, bundle, bundle_dir, external_modules, generator,
+                          cores_to_use_for_make, environment)
+        bundle_dirs.append(bundle_dir)
+
+    # Build the bundles sharing one budget of make jobs
+    # -------------------------------------------------
+    progress = BuildProgress(logger)
+    with Jobserver(cores_to_use_for_make, bundles_in_parallel) as jobserver:
+        task_args = [(logger, bundle, bundle_dir, jobserver, progress, failure_tail_lines)
+                     for bundle, bundle_dir in zip(bundles, bundle_dirs)]
+        results = run_dependent_tasks(logger, bundles, waits, make_bundle, task_args,
+                                      bundles_in_parallel)
+
+    # Write out information about the builds
+    # --------------------------------------
+    bundle_len = len(max(bundles, key=len))
+
+    logger.info(f'')
+    logger.info(f'Bundle build summary:')
+    logger.info(f'---------------------')
+    for bundle, bundle_dir, (status, duration) in zip(bundles, bundle_dirs, results):
+        make_log = os.path.join(bundle_dir, 'jedi_bundle_make.log')
+        logger.info(f'{bundle.ljust(bundle_len)} {status.ljust(7)} {duration:8.1f}s  {make_log}')
+    logger.info(f'---------------------')
+
+    # Write out how much of each build was served from the compiler cache
+    # -------------------------------------------------------------------
+    if compiler_cache is not None:
+        logger.info(f'')
+        logger.info(f'Compiler cache summary:')
+        logger.info(f'-----------------------')
+        for bundle, bundle_dir in zip(bundles, bundle_dirs):
+            stats_log = os.path.join(bundle_dir, 'jedi_bundle_ccache_stats.log')
+            hits, misses, others = read_compiler_cache_stats(stats_log)
+            hit_rate = 100.0 * hits / max(1, hits + misses)
+            logger.info(f'{bundle.ljust(bundle_len)} {hits:7d} hits {misses:7d} misses ' +
+                        f'{hit_rate:6.1f}% hit rate {others:7d} not cacheable')
+        logger.info(f'-----------------------')
 
-        # Make file executable
-        os.chmod(make_file, 0o755)
+    failed_bundles = [bundle for bundle, (status, _) in zip(bundles, results)
+                      if status != 'passed']
+    logger.assert_abort(not failed_bundles, f'The bundles {failed_bundles} failed or were skipped.')
 
-        # Configure command
-        configure = [f'./jedi_bundle_make.sh']
 
-        # Run command
-        cwd = os.getcwd()
-        os.chdir(bundle_dir)
-        process = subprocess.run(configure)
-        logger.assert_abort(process.returncode == 0, f'Make for {bundle} bundle failed.')
-        os.chdir(cwd)
 # --------------------------------------------------------------------------------------------------
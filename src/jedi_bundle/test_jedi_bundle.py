@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2022 United States Government as represented by the Administrator of the
+# National Aeronautics and Space Administration. All Rights Reserved.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+
+
+import heapq
+import io
+import os
+import re
+
+from jedi_bundle.config import config_registry
+from jedi_bundle.utils.build_log import BuildProgress, failure_report
+from jedi_bundle.utils.config import config_get
+from jedi_bundle.utils.file_system import remove_file, subprocess_run, write_file_if_changed
+from jedi_bundle.utils.parallel import run_dependent_tasks
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Line written by ctest for each test that finishes, e.g.
+# ' 3/45 Test  #3: test_oops_qg .......................***Failed    2.31 sec'
+test_result_pattern = re.compile(r'^\s*\d+/\d+ Test\s+#\d+: (\S+) \.*\s*\**(.+?)\s+([\d.]+) sec')
+
+# Line written by ctest once all the tests have run
+test_summary_pattern = re.compile(r'(\d+)% tests passed, (\d+) tests? failed out of (\d+)')
+
+# MPIEXEC_* settings in the configure options of a platform and in the CMake cache
+mpiexec_directive_pattern = re.compile(r'-D(MPIEXEC_\w+)(?::\w+)?="?([^"\s]*)"?')
+mpiexec_cache_pattern = re.compile(r'^(MPIEXEC_\w+):\w+=(.*)$')
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def node_cores():
+
+    # Cores this process is allowed to run on, which can be fewer than the node has
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def mpiexec_settings(logger, platform, modules, path_to_build):
+
+    # How the tests launch MPI. The settings passed to configure for the platform are used when
+    # there is a platform, otherwise those CMake found are read from the cache.
+    settings = {}
+    if platform != 'none':
+        platform_dict = config_registry.get(logger, 'platforms', platform + '.yaml')
+        modules_dict = platform_dict['modules'][modules]
+        configure = config_get(logger, modules_dict, 'configure', '')
+        for name, value in mpiexec_directive_pattern.findall(configure):
+            settings[name] = value
+        return settings
+
+    cmake_cache = os.path.join(path_to_build, 'CMakeCache.txt')
+    if os.path.exists(cmake_cache):
+        with open(cmake_cache, 'r') as cmake_cache_open:
+            for line in cmake_cache_open:
+                match = mpiexec_cache_pattern.match(line.rstrip())
+                if match:
+                    settings[match.group(1)] = match.group(2)
+
+    return settings
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def mpi_environment(logger, settings, disable_mpi_pinning):
+
+    # Launchers started by hand pin their ranks to the first cores of the node, so tests running
+    # at the same time would all share the same cores. Unless asked otherwise pinning is turned
+    # off and the operating system spreads the ranks over the node. Slurm places the ranks of srun
+    # itself.
+    mpiexec = os.path.basename(settings.get('MPIEXEC_EXECUTABLE', 'mpirun'))
+    if mpiexec == 'srun':
+        if 'SLURM_JOB_ID' not in os.environ:
+            logger.info(f'The tests are launched with srun but this is not a Slurm allocation, ' +
+                        f'the MPI tests are likely to fail.')
+        return {}
+
+    if not disable_mpi_pinning:
+        return {}
+
+    environment = {
+        'I_MPI_PIN': 'off',
+        'OMPI_MCA_hwloc_base_binding_policy': 'none',
+        'MV2_ENABLE_AFFINITY': '0',
+    }
+    variables = ' '.join(f'{variable}={value}' for variable, value in environment.items())
+    logger.info(f'Pinning of the MPI ranks is turned off so that the tests running at the same ' +
+                f'time do not share cores ({variables}). Set disable_mpi_pinning to false to ' +
+                f'keep it.')
+
+    return environment
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def write_test_script(logger, path_to_build, bundle_dir, external_modules, environment, cores,
+                      ctest_options):
+
+    test_file = os.path.join(bundle_dir, 'jedi_bundle_test.sh')
+
+    # Write steps to file. ctest counts a test with the PROCESSORS property, which ecbuild sets to
+    # the number of MPI ranks, as that many of its jobs so the multi rank tests are packed into
+    # the cores without running more ranks than cores. Arguments to the script are passed to
+    # ctest.
+    with io.StringIO() as test_file_open:
+        test_file_open.write(f'#!/usr/bin/env bash \n')
+        test_file_open.write(f'\n')
+        if not external_modules:
+            modules_init = os.path.join(path_to_build, 'modules-init')
+            test_file_open.write(f'source {modules_init} \n')
+            modules_load = os.path.join(path_to_build, 'modules')
+            test_file_open.write(f'source {modules_load} \n')
+        test_file_open.write(f'\n')
+        if environment:
+            for variable, value in environment.items():
+                test_file_open.write(f'export {variable}={value} \n')
+            test_file_open.write(f'\n')
+        test_file_open.write(f'ctest -j{cores} {ctest_options} "$@" \n')
+
+        # Write the executable file
+        write_file_if_changed(logger, test_file, test_file_open.getvalue(), 0o755)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def failed_tests_pathfile(bundle_dir):
+
+    return os.path.join(bundle_dir, 'Testing', 'Temporary', 'LastTestsFailed.log')
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def test_bundle(logger, bundle, bundle_dir, rerun_failed, progress, failure_tail_lines,
+                test_results):
+
+    # Only the tests that failed last time are run again, a bundle without failures is done
+    command = ['./jedi_bundle_test.sh']
+    if rerun_failed:
+        failed_pathfile = failed_tests_pathfile(bundle_dir)
+        if not os.path.exists(failed_pathfile) or os.path.getsize(failed_pathfile) == 0:
+            progress.info(f'No failed tests to rerun for the {bundle} bundle')
+            return True
+        command.append('--rerun-failed')
+
+    progress.info(f'Started testing the {bundle} bundle')
+
+    # Output of each bundle goes to its own log, the time taken by each test is kept for the
+    # report of the slowest tests
+    test_log = os.path.join(bundle_dir, 'jedi_bundle_test.log')
+    remove_file(logger, test_log)
+
+    tests = []
+    counts = {}
+
+    def follow_line(line):
+        progress.update(bundle, line)
+        match = test_result_pattern.match(line)
+        if match:
+            tests.append((match.group(1), match.group(2), float(match.group(3))))
+        match = test_summary_pattern.search(line)
+        if match:
+            counts['failed'] = int(match.group(2))
+            counts['total'] = int(match.group(3))
+
+    progress.start(bundle)
+    try:
+        # subprocess_run records the span of ctest, with the bundle directory as attribute
+        result = subprocess_run(logger, command, False, cwd=bundle_dir, log_pathfile=test_log,
+                                tail_lines=failure_tail_lines, line_callback=follow_line)
+    finally:
+        progress.finish(bundle)
+
+    test_results[bundle] = (tests, counts)
+
+    # ctest leaves the list of failed tests from an earlier run behind when every test passes
+    if result.returncode == 0:
+        remove_file(logger, failed_tests_pathfile(bundle_dir))
+        progress.info(f'Finished testing the {bundle} bundle in {result.duration:.1f}s')
+    else:
+        progress.info(failure_report(f'Tests of the {bundle} bundle', result, []))
+
+    return result.returncode == 0
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def test_jedi(logger, test_config):
+
+    # Parse the config
+    bundles = config_get(logger, test_config, 'bundles')
+    path_to_build = config_get(logger, test_config, 'path_to_build')
+    platform = config_get(logger, test_config, 'platform', 'none')
+    modules = config_get(logger, test_config, 'modules', 'none')
+    external_modules = config_get(logger, test_config, 'external_modules', False)
+    cores_to_use_for_test = config_get(logger, test_config, 'cores_to_use_for_test', 0)
+    test_bundles_in_parallel = config_get(logger, test_config, 'test_bundles_in_parallel', 2)
+    ctest_options = config_get(logger, test_config, 'ctest_options', '--output-on-failure')
+    slowest_tests_to_show = config_get(logger, test_config, 'slowest_tests_to_show', 10)
+    rerun_failed = config_get(logger, test_config, 'rerun_failed', False)
+    disable_mpi_pinning = config_get(logger, test_config, 'disable_mpi_pinning', True)
+    failure_tail_lines = config_get(logger, test_config, 'failure_tail_lines', 40)
+
+    # Only bundles that were configured with tests can be tested
+    # ----------------------------------------------------------
+    bundles_with_tests = []
+    for bundle in bundles:
+        if os.path.exists(os.path.join(path_to_build, bundle, 'CTestTestfile.cmake')):
+            bundles_with_tests.append(bundle)
+        else:
+            logger.info(f'The {bundle} bundle has no tests in {path_to_build}, skipping.')
+
+    if not bundles_with_tests:
+        logger.info(f'None of the bundles {bundles} have tests to run.')
+        return
+    bundles = bundles_with_tests
+
+    # Share the cores of the node between the bundles tested at the same time
+    # -----------------------------------------------------------------------
+    if cores_to_use_for_test <= 0:
+        cores_to_use_for_test = node_cores()
+    bundles_in_parallel = max(1, min(test_bundles_in_parallel, len(bundles),
+                                     cores_to_use_for_test))
+    cores_per_bundle = max(1, cores_to_use_for_test // bundles_in_parallel)
+
+    settings = mpiexec_settings(logger, platform, modules, path_to_build)
+    environment = mpi_environment(logger, settings, disable_mpi_pinning)
+
+    logger.info(f'')
+    logger.info(f'Testing the bundles {bundles} using {cores_to_use_for_test} cores, with up to ' +
+                f'{bundles_in_parallel} bundles at a time and {cores_per_bundle} cores each')
+    if settings:
+        mpiexec = ' '.join(f'{name}={value}' for name, value in settings.items())
+        logger.info(f'MPI tests are launched with {mpiexec}')
+    logger.info(f'')
+
+    # Write the test script of each bundle
+    # ------------------------------------
+    bundle_dirs = []
+    for bundle in bundles:
+        bundle_dir = os.path.join(path_to_build, bundle)
+        write_test_script(logger, path_to_build, bundle_dir, external_modules, environment,
+                          cores_per_bundle, ctest_options)
+        bundle_dirs.append(bundle_dir)
+
+    # Run the tests of the bundles
+    # ----------------------------
+    progress = BuildProgress(logger, action='Testing')
+    test_results = {}
+    task_args = [(logger, bundle, bundle_dir, rerun_failed, progress, failure_tail_lines,
+                  test_results) for bundle, bundle_dir in zip(bundles, bundle_dirs)]
+    waits = {bundle: [] for bundle in bundles}
+    results = run_dependent_tasks(logger, bundles, waits, test_bundle, task_args,
+                                  bundles_in_parallel)
+
+    # Write out information about the tests
+    # -------------------------------------
+    bundle_len = len(max(bundles, key=len))
+
+    logger.info(f'')
+    logger.info(f'Bundle test summary:')
+    logger.info(f'--------------------')
+    for bundle, bundle_dir, (status, duration) in zip(bundles, bundle_dirs, results):
+        tests, counts = test_results.get(bundle, ([], {}))
+        passed = ''
+        if counts:
+            passed = f'{counts["total"] - counts["failed"]}/{counts["total"]} passed'
+        test_log = os.path.join(bundle_dir, 'jedi_bundle_test.log')
+        logger.info(f'{bundle.ljust(bundle_len)} {status.ljust(7)} {duration:8.1f}s ' +
+                    f'{passed.rjust(15)}  {test_log}')
+    logger.info(f'--------------------')
+
+    # Write out the tests that took the longest
+    # -----------------------------------------
+    all_tests = [(seconds, bundle, name, test_status)
+                 for bundle, (tests, _) in test_results.items()
+                 for name, test_status, seconds in tests]
+    slowest_tests = heapq.nlargest(slowest_tests_to_show, all_tests)
+    if slowest_tests:
+        name_len = len(max([name for _, _, name, _ in slowest_tests], key=len))
+        logger.info(f'')
+        logger.info(f'Slowest tests:')
+        logger.info(f'--------------')
+        for seconds, bundle, name, test_status in slowest_tests:
+            logger.info(f'{seconds:8.1f}s {bundle.ljust(bundle_len)} {name.ljust(name_len)} ' +
+                        f'{test_status}')
+        logger.info(f'--------------')
+
+    failed_bundles = [bundle for bundle, (status, _) in zip(bundles, results)
+                      if status != 'passed']
+    logger.assert_abort(not failed_bundles, f'The tests of the bundles {failed_bundles} failed. ' +
+                        f'Run the test task with --rerun-failed to run only the failed tests ' +
+                        f'again.')
+
+
+# --------------------------------------------------------------------------------------------------
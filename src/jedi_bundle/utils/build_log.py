@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2022 United States Government as represented by the Administrator of the
+# National Aeronautics and Space Administration. All Rights Reserved.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+
+
+import re
+import sys
+import threading
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Progress markers written by make ('[ 45%] Building ...'), ninja ('[120/800] Building ...') and
+# ctest (' 12/150 Test  #37: ...')
+make_progress_pattern = re.compile(r'^\[\s*(\d+)%\]')
+ninja_progress_pattern = re.compile(r'^\[(\d+)/(\d+)\]')
+ctest_progress_pattern = re.compile(r'^\s*(\d+)/(\d+) Test\s+#')
+
+# Lines reporting a compiler error, e.g. 'file.cc:10:5: error: ...' from gcc and clang,
+# 'file.f90(10): error #6404: ...' from the Intel compilers and 'Error: ...' from gfortran
+error_pattern = re.compile(r'(:\s*(fatal )?error\b|\berror #\d+|^Error:|^CMake Error)')
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def progress_percent(line):
+
+    # Percentage of the build completed according to the line, None if it is not a progress line
+    match = make_progress_pattern.match(line)
+    if match:
+        return int(match.group(1))
+
+    match = ninja_progress_pattern.match(line) or ctest_progress_pattern.match(line)
+    if match and int(match.group(2)) > 0:
+        return int(100 * int(match.group(1)) / int(match.group(2)))
+
+    return None
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+class BuildProgress:
+
+    # Follows the output of one or more builds running at the same time. On a terminal a single
+    # line showing the progress of each running build is kept up to date, otherwise a message is
+    # written each time a build passes another tenth of its progress. For each build only the
+    # first compiler error and the lines following it are kept, so memory does not grow with the
+    # length of the build.
+
+    def __init__(self, logger, error_context_lines=5, action='Building'):
+
+        self.logger = logger
+        self.action = action
+        self.error_context_lines = error_context_lines
+        self.interactive = sys.stdout.isatty()
+        self.lock = threading.Lock()
+
+        self.percents = {}
+        self.first_errors = {}
+        self.line_shown = False
+
+    # ----------------------------------------------------------------------------------------------
+
+    def start(self, name):
+
+        with self.lock:
+            self.percents[name] = 0
+            self.first_errors[name] = []
+
+    # ----------------------------------------------------------------------------------------------
+
+    def update(self, name, line):
+
+        with self.lock:
+
+            # Keep the first error and a few lines of context after it
+            first_error = self.first_errors[name]
+            if first_error and len(first_error) <= self.error_context_lines:
+                first_error.append(line)
+            elif not first_error and error_pattern.search(line):
+                first_error.append(line)
+
+            # CMake counts the progress of bundles sharing a build tree together so the markers
+            # can overshoot or go back, only forward progress up to 100% is shown
+            percent = progress_percent(line)
+            if percent is None or percent <= self.percents[name]:
+                return
+            percent = min(percent, 100)
+            previous_percent = self.percents[name]
+            self.percents[name] = percent
+
+            if self.interactive:
+                self.show_line()
+            elif percent // 10 > previous_percent // 10:
+                self.logger.info(f'{self.action} {name}: {percent}%')
+
+    # ----------------------------------------------------------------------------------------------
+
+    def finish(self, name):
+
+        with self.lock:
+            del self.percents[name]
+            self.clear_line()
+
+    # ----------------------------------------------------------------------------------------------
+
+    def first_error(self, name):
+
+        with self.lock:
+            return list(self.first_errors.get(name, []))
+
+    # ----------------------------------------------------------------------------------------------
+
+    def info(self, message):
+
+        # Write a message without it being mixed with the progress line
+        with self.lock:
+            self.clear_line()
+            self.logger.info(message)
+            if self.interactive and self.percents:
+                self.show_line()
+
+    # ----------------------------------------------------------------------------------------------
+
+    def show_line(self):
+
+        progress_line = ' | '.join(f'{name} {percent:3d}%' for name, percent in
+                                   self.percents.items())
+        sys.stdout.write(f'\r\033[K{self.action}: {progress_line}')
+        sys.stdout.flush()
+        self.line_shown = True
+
+    # ----------------------------------------------------------------------------------------------
+
+    def clear_line(self):
+
+        if self.line_shown:
+            sys.stdout.write('\r\033[K')
+            sys.stdout.flush()
+            self.line_shown = False
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def failure_report(name, result, first_error):
+
+    # What is shown when a build step fails: the first compiler error, which is usually the cause,
+    # and the last lines of output, with the log holding everything else
+    report = [f'{name} failed with return code {result.returncode}, the full output is in ' +
+              f'{result.log_path}']
+    if result.timed_out:
+        report = [f'{name} was killed after exceeding its timeout, the full output is in ' +
+                  f'{result.log_path}']
+    if first_error:
+        report.append('First error:')
+        report.extend(f'  {line}' for line in first_error)
+    if result.tail:
+        report.append(f'Last {len(result.tail)} lines of output:')
+        report.extend(f'  {line}' for line in result.tail)
+
+    return '\n'.join(report)
+
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2022 United States Government as represented by the Administrator of the
+# National Aeronautics and Space Administration. All Rights Reserved.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def user_cache_directory():
+
+    # Follow the XDG convention for the location of user caches
+    xdg_cache_home = os.environ.get('XDG_CACHE_HOME', '')
+    if xdg_cache_home == '':
+        xdg_cache_home = os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(xdg_cache_home, 'jedi_bundle')
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def make_shared_directory(path, root=None):
+
+    # Create a directory that the other members of the group can also write to. Only the
+    # directories from root (by default the directory itself) down to path are shared, missing
+    # parents above root are created with the usual permissions of the user. The setgid bit makes
+    # everything created inside belong to the same group.
+    path = os.path.abspath(path)
+    root = path if root is None else os.path.abspath(root)
+    if os.path.isdir(path):
+        return
+
+    if path == root:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    else:
+        make_shared_directory(os.path.dirname(path), root)
+
+    try:
+        os.mkdir(path)
+        os.chmod(path, 0o2775)
+    except FileExistsError:
+        pass
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def write_json_atomic(pathfile, content):
+
+    # Write to a temporary file in the same directory and rename it in place. Readers therefore
+    # never see a partially written file and concurrent writers simply replace one another.
+    directory = os.path.dirname(pathfile)
+    file_descriptor, temp_pathfile = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(file_descriptor, 'w') as temp_file:
+            json.dump(content, temp_file)
+        os.chmod(temp_pathfile, 0o664)
+        os.replace(temp_pathfile, pathfile)
+    except Exception:
+        if os.path.exists(temp_pathfile):
+            os.remove(temp_pathfile)
+        raise
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+class ResolutionCache:
+
+    def __init__(self, logger, cache_dir, ttl, refresh=False, negative_ttl=0,
+                 github_url='https://github.com', github_api_url='https://api.github.com/repos'):
+
+        self.logger = logger
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.refresh = refresh
+
+        # Lifetime of the entries saying that something was not found, which can change at any
+        # moment (e.g. a branch being pushed) so is typically much shorter than ttl. Zero means
+        # they are not cached.
+        self.negative_ttl = min(negative_ttl, ttl)
+
+        # The answers depend on the GitHub instance that is queried
+        self.host = f'{github_url} {github_api_url}'
+
+        # A ttl of zero disables the cache
+        self.enabled = ttl > 0
+
+        # Track how the cache was used during this run
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if self.enabled:
+            try:
+                make_shared_directory(self.cache_dir)
+            except OSError as e:
+                self.logger.info(f'Unable to create resolution cache {self.cache_dir}, caching ' +
+                                 f'is disabled: {e}')
+                self.enabled = False
+
+    # ----------------------------------------------------------------------------------------------
+
+    def pathfile(self, org, repo, kind, ref):
+
+        # Entries are grouped by organization and repo, with a hash of the GitHub instance, kind
+        # and ref as the file name since refs can contain characters that are not valid in a
+        # file name
+        key = hashlib.sha1(f'{self.host}:{kind}:{ref}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, org, repo, key + '.json')
+
+    # ----------------------------------------------------------------------------------------------
+
+    def get(self, org, repo, kind, ref=''):
+
+        # Return the cached value or None when there is no valid entry
+        if not self.enabled or self.refresh:
+            return None
+
+        try:
+            with open(self.pathfile(org, repo, kind, ref), 'r') as entry_file:
+                entry = json.load(entry_file)
+            ttl = self.negative_ttl if entry['value'] is False else self.ttl
+            if time.time() - entry['time'] > ttl:
+                value = None
+            else:
+                value = entry['value']
+        except Exception:
+            value = None
+
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return value
+
+    # ----------------------------------------------------------------------------------------------
+
+    def set(self, org, repo, kind, ref, value):
+
+        if not self.enabled or (value is False and self.negative_ttl <= 0):
+            return
+
+        entry = {
+            'host': self.host,
+            'org': org,
+            'repo': repo,
+            'kind': kind,
+            'ref': ref,
+            'value': value,
+            'time': time.time(),
+        }
+
+        # Failing to write the cache should never fail the clone
+        try:
+            pathfile = self.pathfile(org, repo, kind, ref)
+            make_shared_directory(os.path.dirname(pathfile), self.cache_dir)
+            write_json_atomic(pathfile, entry)
+        except Exception as e:
+            self.logger.trace(f'Failed to write resolution cache entry for {org}/{repo}: {e}')
+
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2022 United States Government as represented by the Administrator of the
+# National Aeronautics and Space Administration. All Rights Reserved.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+
+
+import os
+
+from jedi_bundle.utils.cache import user_cache_directory
+from jedi_bundle.utils.config import config_get
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def compiler_cache_settings(logger, config):
+
+    # Returns the compiler cache executable, or None when no cache is used, along with its cache
+    # directory and size limit
+    compiler_cache = config_get(logger, config, 'compiler_cache', 'none')
+    default_dir = os.path.join(user_cache_directory(), 'ccache')
+    compiler_cache_dir = config_get(logger, config, 'compiler_cache_dir', default_dir)
+    compiler_cache_max_size = config_get(logger, config, 'compiler_cache_max_size', '20G')
+
+    valid_compiler_caches = ['none', 'ccache']
+    if compiler_cache not in valid_compiler_caches:
+        logger.abort(f'The compiler cache \'{compiler_cache}\' is not one of ' +
+                     f'{valid_compiler_caches}.')
+
+    if compiler_cache == 'none':
+        return None, compiler_cache_dir, compiler_cache_max_size
+
+    if compiler_cache_dir == '':
+        compiler_cache_dir = default_dir
+
+    return compiler_cache, compiler_cache_dir, compiler_cache_max_size
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def compiler_launcher_directives(compiler_cache):
+
+    directives = ''
+    for language in ['C', 'CXX', 'Fortran']:
+        directives = directives + f'-DCMAKE_{language}_COMPILER_LAUNCHER={compiler_cache} '
+
+    return directives
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def compiler_cache_environment(compiler_cache_dir, path_to_source, stats_log):
+
+    # Variables for the compilations of one bundle. The base directory lets builds in different
+    # build directories share cache entries and the stats log records the result of each
+    # compilation of the bundle.
+    return {
+        'CCACHE_DIR': compiler_cache_dir,
+        'CCACHE_BASEDIR': path_to_source,
+        'CCACHE_STATSLOG': stats_log,
+    }
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Outcomes in the compiler cache stats log that mean a compilation was served from the cache or
+# had to be compiled. Recent ccache also writes sub outcomes in the same block, such as
+# direct_cache_miss before preprocessed_cache_hit or local_storage_miss after cache_miss, which do
+# not change the outcome of the compilation.
+compiler_cache_hits = ['direct_cache_hit', 'preprocessed_cache_hit', 'cache hit (direct)',
+                       'cache hit (preprocessed)']
+compiler_cache_misses = ['cache_miss', 'cache miss']
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def read_compiler_cache_stats(stats_log):
+
+    # The stats log has a '# <source file>' line for each compilation followed by its outcomes.
+    # Each compilation is counted once, as a hit, a miss or, for outcomes that are neither such as
+    # unsupported languages, separately.
+    counts = {'hit': 0, 'miss': 0, 'other': 0}
+
+    if not os.path.exists(stats_log):
+        return 0, 0, 0
+
+    def count_compilation(outcomes):
+        if any(outcome in compiler_cache_hits for outcome in outcomes):
+            counts['hit'] += 1
+        elif any(outcome in compiler_cache_misses for outcome in outcomes):
+            counts['miss'] += 1
+        elif outcomes:
+            counts['other'] += 1
+
+    outcomes = []
+    with open(stats_log, 'r') as stats_log_open:
+        for line in stats_log_open:
+            line = line.strip().lower()
+            if line.startswith('#'):
+                count_compilation(outcomes)
+                outcomes = []
+            elif line != '':
+                outcomes.append(line)
+    count_compilation(outcomes)
+
+    return counts['hit'], counts['miss'], counts['other']
+
+
+# --------------------------------------------------------------------------------------------------
@@ -9,10 +9,19 @@
 # --------------------------------------------------------------------------------------------------
 
 
+import collections
+import contextlib
+import fcntl
 import os
+import shutil
+import signal
 import subprocess
+import tempfile
+import threading
+import time
 
 from jedi_bundle.utils.logger import colors
+from jedi_bundle.utils.trace import traced
 
 
 # --------------------------------------------------------------------------------------------------
@@ -52,34 +61,199 @@ def prompt_and_remove_file(logger, pathfile):
 # --------------------------------------------------------------------------------------------------
 
 
+def write_file_if_changed(logger, pathfile, content, mode=None):
+
+    # Write content to a file only when it differs from what the file already holds, so that tools
+    # watching the modification time (e.g. CMake) do not see a change. The new file is written to a
+    # temporary file in the same directory and renamed in place. Returns True if the file was
+    # written.
+    if os.path.exists(pathfile):
+        with open(pathfile, 'r') as pathfile_open:
+            if pathfile_open.read() == content:
+                if mode is not None:
+                    os.chmod(pathfile, mode)
+                return False
+
+    directory = os.path.dirname(os.path.abspath(pathfile))
+    file_descriptor, temp_pathfile = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(file_descriptor, 'w') as temp_file:
+            temp_file.write(content)
+        if mode is None:
+            mode = 0o644
+            if os.path.exists(pathfile):
+                mode = os.stat(pathfile).st_mode & 0o7777
+        os.chmod(temp_pathfile, mode)
+        os.replace(temp_pathfile, pathfile)
+    except Exception as e:
+        if os.path.exists(temp_pathfile):
+            os.remove(temp_pathfile)
+        logger.abort(f'Failed to write the file {pathfile}, with exception: {e}.')
+
+    return True
+
+
+# --------------------------------------------------------------------------------------------------
+
+
 def check_for_executable(logger, executable):
 
     # Check for executable
-    rc = subprocess_run(logger, ['which', executable], False)
-    if rc != 0:
+    if shutil.which(executable) is None:
         logger.abort(f'Did not find {executable} in the path')
 
 
 # --------------------------------------------------------------------------------------------------
 
 
-def subprocess_run(logger, command, abort_on_fail=True):
+@contextlib.contextmanager
+def file_lock(lock_pathfile, shared=False):
+
+    # Advisory lock on a file, shared between readers or exclusive for a writer. The lock file is
+    # writable by the group so that users sharing a directory can all take the lock.
+    lock_fd = os.open(lock_pathfile, os.O_RDWR | os.O_CREAT, 0o664)
+    try:
+        os.fchmod(lock_fd, 0o664)
+    except PermissionError:
+        pass
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Result of a command run with subprocess_run: the return code, the time taken in seconds, the log
+# the output was written to (None if not logged), the last lines of output and whether the command
+# was killed for running longer than its timeout
+SubprocessResult = collections.namedtuple('SubprocessResult', ['returncode', 'duration',
+                                                               'log_path', 'tail', 'timed_out'])
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Commands running in their own process group, which a Ctrl-C at the terminal does not reach
+detached_processes = set()
+detached_processes_lock = threading.Lock()
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def interrupt_handler(signal_number, frame):
 
-    # Prepare command
-    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Handler for SIGINT that passes the interrupt on to the commands running in their own process
+    # group, including those started from worker threads, before interrupting Python as usual
+    with detached_processes_lock:
+        pids = [process.pid for process in detached_processes]
+
+    for pid in pids:
+        try:
+            os.killpg(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
 
-    # Run process
-    output, error = p.communicate()
+    raise KeyboardInterrupt
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+@traced('subprocess', 'command', 'cwd')
+def subprocess_run(logger, command, abort_on_fail=True, cwd=None, log_pathfile=None, timeout=None,
+                   tail_lines=50, env=None, pass_fds=(), line_callback=None):
+
+    # Run a command streaming its combined output to a log file as it arrives. Only the last lines
+    # are kept in memory, for the error message. Each line is also passed to line_callback when
+    # one is given. With a timeout the command runs in its own process group so that everything it
+    # started is killed when it exceeds the timeout. Otherwise it stays in the group of the
+    # terminal so that Ctrl-C reaches it.
+    start_time = time.time()
+    join_command = ' '.join(command)
+
+    tail = collections.deque(maxlen=tail_lines)
+    timed_out = []
+
+    log_open = None
+    if log_pathfile is not None:
+        log_open = open(log_pathfile, 'ab')
+        log_open.write(f'$ {join_command}\n'.encode('utf-8'))
+
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   cwd=cwd, env=env, pass_fds=pass_fds,
+                                   start_new_session=bool(timeout))
+
+        def kill(signal_number):
+            try:
+                if timeout:
+                    os.killpg(process.pid, signal_number)
+                else:
+                    process.send_signal(signal_number)
+            except ProcessLookupError:
+                pass
+
+        def kill_on_timeout():
+            timed_out.append(True)
+            kill(signal.SIGKILL)
+
+        timer = None
+        if timeout:
+            with detached_processes_lock:
+                detached_processes.add(process)
+            timer = threading.Timer(timeout, kill_on_timeout)
+            timer.start()
+
+        try:
+            for line in iter(process.stdout.readline, b''):
+                if log_open is not None:
+                    log_open.write(line)
+                    log_open.flush()
+                line_str = line.decode('utf-8', 'replace').rstrip()
+                tail.append(line_str)
+                if line_callback is not None:
+                    line_callback(line_str)
+
+        # Interrupted (e.g. Ctrl-C) or failed while reading, do not leave the command running
+        except BaseException:
+            kill(signal.SIGTERM)
+            process.wait()
+            raise
+
+        finally:
+            if timer is not None:
+                timer.cancel()
+                with detached_processes_lock:
+                    detached_processes.discard(process)
+
+        process.stdout.close()
+        process.wait()
+
+    finally:
+        if log_open is not None:
+            log_open.close()
+
+    result = SubprocessResult(process.returncode, time.time() - start_time, log_pathfile,
+                              list(tail), bool(timed_out))
 
     # Abort message if monitoring failure
-    if p.returncode != 0 and abort_on_fail:
-        join_command = ' '.join(command)
-        error_str = error.decode("utf-8")
-        logger.abort(f'In subprocess_run the command \'{join_command}\' failed with ' +
-                     f'error {error_str}.')
-
-    # Return error code
-    return p.returncode
+    if result.returncode != 0 and abort_on_fail:
+        reason = f'failed with return code {result.returncode}'
+        if result.timed_out:
+            reason = f'was killed after exceeding the timeout of {timeout} seconds'
+        where = ''
+        if log_pathfile is not None:
+            where = f' The full output is in {log_pathfile}.'
+        tail_str = '\n'.join(result.tail)
+        logger.abort(f'In subprocess_run the command \'{join_command}\' {reason}.{where} ' +
+                     f'Last lines of output:\n{tail_str}')
+
+    return result
 
 
 # --------------------------------------------------------------------------------------------------
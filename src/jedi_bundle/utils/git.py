@@ -9,12 +9,18 @@
 # --------------------------------------------------------------------------------------------------
 
 
+import concurrent.futures
+import contextlib
 import os
-import requests
 import subprocess
+import threading
 
+from jedi_bundle.utils.cache import make_shared_directory
 from jedi_bundle.utils.config import config_get
-from jedi_bundle.utils.file_system import devnull, subprocess_run
+from jedi_bundle.utils.file_system import file_lock, remove_file, subprocess_run
+from jedi_bundle.utils.logger import BufferedLogger
+from jedi_bundle.utils.parallel import run_buffered_tasks
+from jedi_bundle.utils.trace import trace_span, traced
 
 
 # --------------------------------------------------------------------------------------------------
@@ -42,137 +48,956 @@ def get_github_username_token(logger):
 # --------------------------------------------------------------------------------------------------
 
 
-def repo_is_reachable(logger, url, username, token):
+class GitHubSession:
 
-    # Default is that the repo is not reachable
-    is_reachable = False
+    def __init__(self, logger, pool_size=10, timeout=30, github_url='https://github.com',
+                 github_api_url='https://api.github.com/repos'):
 
+        self.logger = logger
+        self.timeout = timeout
+
+        # At most pool_size requests to the API are in flight at once, whatever the number of
+        # threads probing
+        self.api_limit = threading.BoundedSemaphore(max(1, pool_size))
+
+        # Where the repos and the repos API are found, a local stand-in can be used for testing
+        self.github_url = github_url
+        self.github_api_url = github_api_url
+
+        # Read the credentials once for the whole run
+        self.username, self.token = get_github_username_token(logger)
+
+        # Pooled session so that every probe reuses warm keep-alive connections to the API. Requests
+        # is only imported when a session is needed since it is slow to import.
+        import requests
+        import requests.adapters
+        self.session = requests.Session()
+        if self.username != '':
+            self.session.auth = (self.username, self.token)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    # ----------------------------------------------------------------------------------------------
+
+    def get(self, url):
+
+        with self.api_limit, trace_span('github api', 'resolve', url=url):
+            return self.session.get(url, timeout=self.timeout)
+
+    # ----------------------------------------------------------------------------------------------
+
+    def close(self):
+
+        self.session.close()
+
+    # ----------------------------------------------------------------------------------------------
+
+    def __enter__(self):
+
+        return self
+
+    # ----------------------------------------------------------------------------------------------
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close()
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def github_repo_status(logger, github_session, url):
+
+    # Returns True if the repo is reachable, False if the API says it is not and None if the
+    # question could not be answered (e.g. network failure or rate limiting)
     try:
-        get = requests.get(url, auth=(username, token))
-        if get.status_code == 200:
-            # Check that the full name provided by API is expected path.
-            # Sometimes this value is inconsistent with the repo path.
-            gh_api_dict = get.json()
-            if 'full_name' in gh_api_dict:
-                full_name = gh_api_dict['full_name']
-                if full_name in url:
-                    is_reachable = True
+        get = github_session.get(url)
     except Exception:
-        is_reachable = False
+        return None
 
-    return is_reachable
+    if get.status_code == 200:
+        # Check that the full name provided by API is expected path.
+        # Sometimes this value is inconsistent with the repo path.
+        try:
+            gh_api_dict = get.json()
+        except Exception:
+            return None
+        if 'full_name' in gh_api_dict:
+            full_name = gh_api_dict['full_name']
+            if full_name in url:
+                return True
+        return False
+
+    elif get.status_code == 404:
+        return False
+
+    return None
 
 
 # --------------------------------------------------------------------------------------------------
 
 
-def repo_has_branch(logger, url, branch, is_tag=False):
+class RefIndex:
 
-    # Command to check if branch exists and pass exit code back
-    heads_or_tags = '--heads'
-    if is_tag:
-        heads_or_tags = '--tags'
+    def __init__(self, url, ls_remote_output):
 
-    git_ls_cmd = ['git', 'ls-remote', heads_or_tags, '--exit-code', url, branch]
+        self.url = url
 
-    # Run command
-    process = subprocess.run(git_ls_cmd, stdout=devnull)
+        # Map of branch and tag names to commit SHAs
+        self.heads = {}
+        self.tags = {}
+
+        for line in ls_remote_output.splitlines():
+            if '\t' not in line:
+                continue
+            sha, ref = line.split('\t', 1)
+            if ref.startswith('refs/heads/'):
+                self.heads[ref[len('refs/heads/'):]] = sha
+            elif ref.startswith('refs/tags/'):
+                tag = ref[len('refs/tags/'):]
+                # Annotated tags are followed by the peeled commit, which takes precedence
+                if tag.endswith('^{}'):
+                    self.tags[tag[:-3]] = sha
+                elif tag not in self.tags:
+                    self.tags[tag] = sha
+
+    # ----------------------------------------------------------------------------------------------
+
+    def has_branch(self, branch):
+
+        return branch in self.heads
+
+    # ----------------------------------------------------------------------------------------------
+
+    def has_tag(self, tag):
+
+        return tag in self.tags
+
+    # ----------------------------------------------------------------------------------------------
+
+    def has_ref(self, ref, is_tag=False):
+
+        if is_tag:
+            return self.has_tag(ref)
+        return self.has_branch(ref)
+
+    # ----------------------------------------------------------------------------------------------
+
+    def sha(self, ref, is_tag=False):
+
+        if is_tag:
+            return self.tags.get(ref)
+        return self.heads.get(ref)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Ref indices for each remote url, fetched at most once per run
+ref_indices = {}
+ref_index_locks = {}
+ref_index_locks_lock = threading.Lock()
+
+# Limit on the number of ls-remote calls running at once, changed with limit_ls_remote
+ls_remote_limit = threading.BoundedSemaphore(8)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def limit_ls_remote(workers):
+
+    global ls_remote_limit
+    ls_remote_limit = threading.BoundedSemaphore(max(1, workers))
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def get_ref_index(logger, url):
+
+    # One lock per url so that concurrent probes of the same remote wait for a single ls-remote
+    with ref_index_locks_lock:
+        if url not in ref_index_locks:
+            ref_index_locks[url] = threading.Lock()
+        url_lock = ref_index_locks[url]
+
+    with url_lock:
+
+        if url not in ref_indices:
+
+            # List all the branches and tags of the remote in a single call
+            git_ls_cmd = ['git', 'ls-remote', '--heads', '--tags', url]
+            with ls_remote_limit, trace_span('git ls-remote', 'subprocess', url=url):
+                process = subprocess.run(git_ls_cmd, stdout=subprocess.PIPE, text=True)
+
+            # A failure is stored as None so the remote is not queried again during this run
+            if process.returncode == 0:
+                ref_indices[url] = RefIndex(url, process.stdout)
+            else:
+                logger.trace(f'Failed to list the refs of {url}.')
+                ref_indices[url] = None
+
+        return ref_indices[url]
 
-    # Return flag based on exit code.
-    if process.returncode == 0:
-        return True
-    else:
-        return False
+
+# --------------------------------------------------------------------------------------------------
+
+
+def remote_ref_status(logger, url, branch, is_tag=False):
+
+    # Returns True if the branch (or tag) exists, False if it does not and None if the remote could
+    # not be queried
+    ref_index = get_ref_index(logger, url)
+
+    if ref_index is None:
+        return None
+
+    return ref_index.has_ref(branch, is_tag)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def cached_repo_is_reachable(logger, github_session, resolution_cache, github_org, repo_url_name,
+                             url):
+
+    # Answer from the resolution cache when possible
+    if resolution_cache is not None:
+        is_reachable = resolution_cache.get(github_org, repo_url_name, 'reachable')
+        if is_reachable is not None:
+            return is_reachable
+
+    is_reachable = github_repo_status(logger, github_session, url)
+
+    # Only definitive answers are cached so that a network failure is not remembered
+    if resolution_cache is not None and is_reachable is not None:
+        resolution_cache.set(github_org, repo_url_name, 'reachable', '', is_reachable)
+
+    return is_reachable is True
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def cached_repo_has_branch(logger, resolution_cache, github_org, repo_url_name, url, branch,
+                           is_tag=False):
+
+    # Answer from the resolution cache when possible
+    kind = 'tag' if is_tag else 'branch'
+    if resolution_cache is not None:
+        has_branch = resolution_cache.get(github_org, repo_url_name, kind, branch)
+        if has_branch is not None:
+            return has_branch
+
+    has_branch = remote_ref_status(logger, url, branch, is_tag)
+
+    # Only definitive answers are cached. A missing ref is remembered for the shorter negative ttl
+    # of the cache since it may be pushed at any moment.
+    if resolution_cache is not None and has_branch is not None:
+        resolution_cache.set(github_org, repo_url_name, kind, branch, has_branch)
+
+    return has_branch is True
 
 
 # --------------------------------------------------------------------------------------------------
 
 
-def get_url_and_branch(logger, github_orgs, repo_url_name, default_branch, user_branch, is_tag_in):
+@traced('resolve', 'github_org', 'repo_url_name', 'default_branch', 'user_branch')
+def probe_github_org(logger, github_session, github_org, repo_url_name, default_branch,
+                     user_branch, is_tag_in, resolution_cache=None):
+
+    # Full path of the repo url
+    github_url = os.path.join(github_session.github_url, github_org, repo_url_name)
+    github_api_url = os.path.join(github_session.github_api_url, github_org, repo_url_name)
+
+    # Result of probing this organization
+    probe = {
+        'url': github_url,
+        'reachable': False,
+        'has_user_branch': False,
+        'has_default_branch': False,
+    }
+
+    # Check it the repo url is reachable
+    if not cached_repo_is_reachable(logger, github_session, resolution_cache, github_org,
+                                    repo_url_name, github_api_url):
+        return probe
+    probe['reachable'] = True
+
+    # Check for user branch. When found the default branch is irrelevant since the user branch
+    # in any organization takes priority over the default branch.
+    if user_branch != '':
+        if cached_repo_has_branch(logger, resolution_cache, github_org, repo_url_name, github_url,
+                                  user_branch):
+            probe['has_user_branch'] = True
+            return probe
+
+    # Check for the default branch
+    probe['has_default_branch'] = cached_repo_has_branch(logger, resolution_cache, github_org,
+                                                         repo_url_name, github_url, default_branch,
+                                                         is_tag_in)
+
+    return probe
+
+
+# --------------------------------------------------------------------------------------------------
 
-    # Get GitHub username and token if .git-credentials file available
-    username, token = get_github_username_token(logger)
 
-    # Track finding of the user branch and the default branch
-    found_default_branch = False
+def find_ref_kind(logger, github_session, github_orgs, repo_url_name, ref, resolution_cache=None):
 
-    # Loop over URLs
-    repo_url_found = False
-    repo_url_to_use = ''
-    repo_branch_to_use = ''
-    is_tag = False
+    # Returns True if ref is a tag, False if it is a branch and None if it was not found in any
+    # organization. As for resolution, the first organization that has the ref decides.
     for github_org in github_orgs:
 
-        # Full path of the repo url
-        github_url = os.path.join('https://github.com', github_org, repo_url_name)
-        github_api_url = os.path.join('https://api.github.com/repos', github_org, repo_url_name)
+        github_url = os.path.join(github_session.github_url, github_org, repo_url_name)
+        github_api_url = os.path.join(github_session.github_api_url, github_org, repo_url_name)
 
-        # Check it the repo url is reachable
-        if repo_is_reachable(logger, github_api_url, username, token):
+        if not cached_repo_is_reachable(logger, github_session, resolution_cache, github_org,
+                                        repo_url_name, github_api_url):
+            continue
 
-            # Assert that the repo was found somewhere
-            repo_url_found = True
+        if cached_repo_has_branch(logger, resolution_cache, github_org, repo_url_name, github_url,
+                                  ref, True):
+            return True
+        if cached_repo_has_branch(logger, resolution_cache, github_org, repo_url_name, github_url,
+                                  ref, False):
+            return False
 
-            # Check for user branch and return right away if found
-            if user_branch != '':
-                if repo_has_branch(logger, github_url, user_branch):
-                    is_tag = False
-                    return repo_url_found, github_url, user_branch, is_tag
+    return None
 
-            # Track first instance of finding the default branch. But do not exit when it's first
-            # found so that other organizations can be checked for the user branch.
-            if not found_default_branch:
-                if repo_has_branch(logger, github_url, default_branch, is_tag_in):
-                    found_default_branch = True
-                    repo_url_found = True
-                    repo_url_to_use = github_url
-                    repo_branch_to_use = default_branch
-                    is_tag = is_tag_in
 
-    return repo_url_found, repo_url_to_use, repo_branch_to_use, is_tag
+# --------------------------------------------------------------------------------------------------
+
+
+def select_url_and_branch(probes, default_branch, user_branch, is_tag_in):
+
+    # Probes are ordered as the organizations so the first match respects the organization priority
+    repo_url_found = any(probe['reachable'] for probe in probes)
+
+    # User branch found in any organization is used right away
+    for probe in probes:
+        if probe['has_user_branch']:
+            return repo_url_found, probe['url'], user_branch, False
+
+    # Otherwise use the first organization where the default branch was found
+    for probe in probes:
+        if probe['has_default_branch']:
+            return repo_url_found, probe['url'], default_branch, is_tag_in
+
+    return repo_url_found, '', '', False
 
 
 # --------------------------------------------------------------------------------------------------
 
 
-def clone_git_repo(logger, url, branch, target, is_tag):
+@traced('subprocess', 'command', 'cwd')
+def git_output(logger, command, cwd=None):
+
+    # Run a git query and return the return code and stripped standard output
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                             cwd=cwd)
+    return process.returncode, process.stdout.strip()
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def command_log_pathfile(clone_settings, target):
+
+    # The output of the git commands run for a repo is kept in one log per repo
+    log_dir = clone_settings.get('log_dir', '')
+    if log_dir == '':
+        return None
+
+    return os.path.join(log_dir, os.path.basename(os.path.normpath(target)) + '.log')
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def clear_command_log(logger, clone_settings, target):
+
+    log_pathfile = command_log_pathfile(clone_settings, target)
+    if log_pathfile is not None:
+        os.makedirs(os.path.dirname(log_pathfile), exist_ok=True)
+        remove_file(logger, log_pathfile)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def run_logged(logger, command, clone_settings, target, abort_on_fail=True, cwd=None):
+
+    # Run a git command for the repo in target with the log and timeout of the clone settings
+    timeout = clone_settings.get('command_timeout', 0)
+    return subprocess_run(logger, command, abort_on_fail, cwd=cwd,
+                          log_pathfile=command_log_pathfile(clone_settings, target),
+                          timeout=timeout if timeout > 0 else None)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def git_clone_command(url, branch, target, clone_settings, reference=''):
+
+    depth = clone_settings.get('depth', 0)
+    filter_spec = clone_settings.get('filter', '')
+    submodule_jobs = clone_settings.get('submodule_jobs', 1)
+
+    git_clone_cmd = ['git', 'clone', '--recursive', '-b', branch]
+
+    # Shallow clone of only the requested ref, including the submodules
+    if depth > 0:
+        git_clone_cmd += ['--depth', str(depth), '--single-branch', '--shallow-submodules']
+
+    # Partial clone, e.g. blob:none fetches file contents only when they are checked out
+    if filter_spec != '':
+        git_clone_cmd += [f'--filter={filter_spec}']
+
+    # Fetch submodules in parallel
+    if submodule_jobs > 1:
+        git_clone_cmd += ['--jobs', str(submodule_jobs)]
+
+    # Borrow objects from a local mirror and copy them into the clone once it is done
+    if reference != '':
+        git_clone_cmd += ['--reference', reference, '--dissociate']
+
+    return git_clone_cmd + [url, target]
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def mirror_path(mirror_dir, url):
+
+    # Location of the bare mirror of a url, e.g. <mirror_dir>/github.com/JCSDA/oops.git
+    location = url.split('://', 1)[-1].strip('/')
+    if not location.endswith('.git'):
+        location = location + '.git'
+
+    return os.path.join(mirror_dir, location)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# Mirrors that have already been refreshed during this run
+refreshed_mirrors = set()
+refreshed_mirrors_lock = threading.Lock()
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def update_mirror(logger, url, mirror, clone_settings, target):
+
+    # Create the mirror or refresh it with a single fetch per run. The output goes to the log of
+    # the repo being cloned to target. Returns False if the mirror could not be brought up to
+    # date.
+    with refreshed_mirrors_lock:
+        if mirror in refreshed_mirrors:
+            return True
+
+    make_shared_directory(os.path.dirname(mirror), clone_settings['mirror_dir'])
+
+    # Exclusive lock so that concurrent runs never write to the same mirror at the same time
+    with file_lock(mirror + '.lock'):
+
+        # Another clone of the same url may have updated the mirror while waiting for the lock
+        with refreshed_mirrors_lock:
+            if mirror in refreshed_mirrors:
+                return True
+
+        if not os.path.exists(mirror):
+            logger.info(f'Creating mirror of {url} in {mirror}')
+            # The mirror is writable by the group, from its creation and in later fetches
+            cmd = ['git', '-c', 'core.sharedRepository=group', 'clone', '--bare', '--config',
+                   'core.sharedRepository=group', url, mirror]
+            rc = run_logged(logger, cmd, clone_settings, target, False).returncode
+        else:
+            logger.info(f'Refreshing mirror of {url} in {mirror}')
+            cmd = ['git', 'fetch', '--prune', 'origin', '+refs/heads/*:refs/heads/*',
+                   '+refs/tags/*:refs/tags/*']
+            rc = run_logged(logger, cmd, clone_settings, target, False, cwd=mirror).returncode
+
+        if rc == 0:
+            with refreshed_mirrors_lock:
+                refreshed_mirrors.add(mirror)
+
+    return rc == 0
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def clone_git_repo_from_mirror(logger, url, branch, target, clone_settings, mirror):
+
+    # Shared lock so that the mirror is not refreshed while a clone is reading from it
+    mirror_mode = clone_settings.get('mirror_mode', 'reference')
+    with file_lock(mirror + '.lock', shared=True):
+
+        if mirror_mode == 'reference':
+
+            # Clone from the remote borrowing all the objects already in the mirror
+            git_clone_cmd = git_clone_command(url, branch, target, clone_settings, mirror)
+            run_logged(logger, git_clone_cmd, clone_settings, target, True)
+
+        elif mirror_mode == 'hardlink':
+
+            # Local clone, objects are hard linked to the mirror. Origin is pointed back to the
+            # remote and what is checked out is the commit the remote has for the branch, so a
+            # mirror that others can write to cannot change what is built. Only the objects
+            # missing from the mirror are fetched.
+            cmd = ['git', 'clone', '--no-checkout', '-b', branch, mirror, target]
+            run_logged(logger, cmd, clone_settings, target, True)
+            cmd = ['git', 'remote', 'set-url', 'origin', url]
+            run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+            cmd = ['git', 'fetch', 'origin', branch]
+            run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+            cmd = ['git', 'reset', '--hard', 'FETCH_HEAD']
+            run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+            cmd = ['git', 'submodule', 'update', '--init', '--recursive']
+            run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+
+        else:
+            logger.abort(f'Mirror mode \'{mirror_mode}\' is not one of [\'reference\', ' +
+                         f'\'hardlink\'].')
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def update_git_repo(logger, url, branch, target, clone_settings):
+
+    # Commands run in the directory where repo is cloned. The working directory of the process is
+    # not changed since clones can run concurrently.
+    depth = clone_settings.get('depth', 0)
+
+    rc, is_shallow = git_output(logger, ['git', 'rev-parse', '--is-shallow-repository'], target)
+    is_shallow = is_shallow == 'true'
+
+    # A single branch clone only fetches the branch it was cloned with so make sure the requested
+    # branch is part of the fetch refspec
+    rc, fetch_refspecs = git_output(logger, ['git', 'config', '--get-all', 'remote.origin.fetch'],
+                                    target)
+    if '*' not in fetch_refspecs and f'refs/heads/{branch}:' not in fetch_refspecs:
+        cmd = ['git', 'remote', 'set-branches', '--add', 'origin', branch]
+        run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+
+    # Fetch. For a shallow repo a branch that has not been fetched before is fetched with the same
+    # depth as the clone, otherwise only the new commits are fetched.
+    if is_shallow or '*' not in fetch_refspecs:
+        cmd = ['git', 'fetch', 'origin', branch]
+        rc, _ = git_output(logger, ['git', 'rev-parse', '--verify', '--quiet',
+                                    f'refs/remotes/origin/{branch}'], target)
+        if is_shallow and rc != 0:
+            cmd = ['git', 'fetch', '--depth', str(max(depth, 1)), 'origin',
+                   f'+refs/heads/{branch}:refs/remotes/origin/{branch}']
+    else:
+        cmd = ['git', 'fetch']
+    run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+
+    # Switch to branch
+    cmd = ['git', 'checkout', branch]
+    run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+
+    # Pull latest
+    cmd = ['git', 'pull', 'origin', branch]
+    rc = run_logged(logger, cmd, clone_settings, target, not is_shallow, cwd=target).returncode
+
+    # Merging can fail in a shallow repo when the history does not reach the merge base. Only then
+    # is the history of the repo fetched in full.
+    if rc != 0:
+        logger.info(f'Repo {url}, shallow history is not sufficient to update, unshallowing...')
+        cmd = ['git', 'fetch', '--unshallow', 'origin', branch]
+        run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+        cmd = ['git', 'pull', 'origin', branch]
+        run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def remote_ref_sha(logger, url, ref, is_tag=False):
+
+    # SHA of a remote ref, listing the refs of the remote when that was not already done during
+    # this run (e.g. because resolution was answered by the cache). None if the remote could not
+    # be listed or does not have the ref.
+    ref_index = get_ref_index(logger, url)
+    if ref_index is None:
+        return None
+
+    return ref_index.sha(ref, is_tag)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+@traced('clone', 'url', 'branch', 'target')
+def clone_git_repo(logger, url, branch, target, is_tag, clone_settings=None):
+
+    # Returns the status of the repo, one of 'cloned', 'up to date' or 'updated (N commits)'
+
+    # Clone settings default to a full clone
+    if clone_settings is None:
+        clone_settings = {}
 
     # Check if directory already exists
     if not os.path.exists(target):
 
-        # Command to check if branch exists and pass exit code back
-        git_clone_cmd = ['git', 'clone', '--recursive', '-b', branch, url, target]
+        # Clone from the local mirror when there is one and it could be brought up to date
+        mirror_dir = clone_settings.get('mirror_dir', '')
+        if mirror_dir != '':
+            mirror = mirror_path(mirror_dir, url)
+            if update_mirror(logger, url, mirror, clone_settings, target):
+                clone_git_repo_from_mirror(logger, url, branch, target, clone_settings, mirror)
+                return 'cloned'
+            logger.info(f'Mirror of {url} could not be updated, cloning from the remote.')
+
+        # Command to clone the branch or tag
+        git_clone_cmd = git_clone_command(url, branch, target, clone_settings)
 
         # Run command
-        subprocess_run(logger, git_clone_cmd, True)
+        run_logged(logger, git_clone_cmd, clone_settings, target, True)
+
+        return 'cloned'
 
     elif is_tag:
 
         logger.info(f'Repo {url}, tag already cloned, skipping...')
 
+        return 'up to date'
+
     else:
 
+        # Local state of the repo
+        rc, local_sha = git_output(logger, ['git', 'rev-parse', 'HEAD'], target)
+        rc, local_branch = git_output(logger, ['git', 'symbolic-ref', '--quiet', '--short', 'HEAD'],
+                                      target)
+
+        # Nothing to do when already on the branch and at the commit the remote points to. The
+        # refs of the remote are listed at most once per run, resolution may already have done
+        # it, and listing them is much cheaper than a fetch.
+        remote_sha = remote_ref_sha(logger, url, branch)
+        if remote_sha is not None and local_branch == branch and local_sha == remote_sha:
+            logger.info(f'Repo {url}, already cloned and up to date with {branch}.')
+            return 'up to date'
+
         # Write info
         logger.info(f'Repo {url}, already cloned. Updating branch...')
 
-        # Switch to directory where repo is cloned
-        cwd = os.getcwd()
-        os.chdir(target)
+        update_git_repo(logger, url, branch, target, clone_settings)
 
-        # Fetch
-        cmd = ['git', 'fetch']
-        subprocess_run(logger, cmd, True)
+        # Count the commits brought in by the update
+        rc, updated_sha = git_output(logger, ['git', 'rev-parse', 'HEAD'], target)
+        if updated_sha == local_sha:
+            return 'up to date'
+        rc, commits = git_output(logger, ['git', 'rev-list', '--count',
+                                          f'{local_sha}..{updated_sha}'], target)
+        if rc != 0:
+            return 'updated'
+        return f'updated ({commits} commits)'
 
-        # Switch to branch
-        cmd = ['git', 'checkout', branch]
-        subprocess_run(logger, cmd, True)
 
-        # Pull latest
-        cmd = ['git', 'pull', 'origin', branch]
-        subprocess_run(logger, cmd, True)
+# --------------------------------------------------------------------------------------------------
+
+
+def clone_git_repo_buffered(repo_logger, repo, url, branch, target, is_tag, clone_settings):
+
+    # Clone a single repo writing all messages to the repo's own buffered logger. The log of the
+    # git commands only holds the output of this run.
+    repo_logger.info(f'Cloning \'{repo}\'.')
+    clear_command_log(repo_logger, clone_settings, target)
+    return clone_git_repo(repo_logger, url, branch, target, is_tag, clone_settings)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+@contextlib.contextmanager
+def deferred_lfs_environment(clone_settings):
+
+    # With deferred LFS the large files are not downloaded during the clone but in a separate stage
+    # afterwards. The environment is shared by all the git processes started during the clones.
+    skip_smudge = clone_settings.get('lfs_strategy', 'inline') == 'deferred'
+    skip_smudge_in = os.environ.get('GIT_LFS_SKIP_SMUDGE')
+    if skip_smudge:
+        os.environ['GIT_LFS_SKIP_SMUDGE'] = '1'
+
+    try:
+        yield
+    finally:
+        if skip_smudge:
+            if skip_smudge_in is None:
+                del os.environ['GIT_LFS_SKIP_SMUDGE']
+            else:
+                os.environ['GIT_LFS_SKIP_SMUDGE'] = skip_smudge_in
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def resolve_and_clone_git_repos(logger, github_session, github_orgs, repos, resolve_list,
+                                user_branch, targets, clone_flags, required_flags, probe_workers,
+                                clone_workers, clone_settings=None, resolution_cache=None):
+
+    # Resolve the url and branch of each repo and start cloning a repo as soon as it is resolved
+    # rather than once every repo is resolved. Every (repo, organization) pair is probed
+    # concurrently and the probes of a repo are reduced in organization order. The probes run on
+    # probe_workers threads, within the limits the session puts on API requests and ls-remote
+    # calls, and the clones run on their own clone_workers threads. Only repos with clone_flags
+    # set are cloned. When a repo with required_flags set is not found or a clone fails no more
+    # clones are started, the running clones are left to finish and the run aborts. Returns the
+    # resolution of each repo and the status of each clone (None for repos not cloned) in the
+    # order of repos.
+
+    if clone_settings is None:
+        clone_settings = {}
+
+    resolved = [None] * len(repos)
+    clone_statuses = [None] * len(repos)
+    failure = None
+
+    with deferred_lfs_environment(clone_settings), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(1, probe_workers)) as \
+            probe_executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(1, clone_workers)) as \
+            clone_executor:
+
+        # Submit all the probes, every (repo, organization) pair is probed concurrently
+        probe_futures = {}
+        repo_futures = []
+        for index, (repo_url_name, default_branch, is_tag_in) in enumerate(resolve_list):
+            repo_futures.append([])
+            for github_org in github_orgs:
+                future = probe_executor.submit(probe_github_org, logger, github_session,
+                                               github_org, repo_url_name, default_branch,
+                                               user_branch, is_tag_in, resolution_cache)
+                probe_futures[future] = index
+                repo_futures[index].append(future)
+
+        clone_futures = {}
+
+        def cancel_pending():
+            for other_future in list(probe_futures) + list(clone_futures):
+                other_future.cancel()
+
+        # Anything raised while waiting (e.g. an interrupt) cancels what has not started yet so
+        # that leaving the executors only waits for the tasks already running
+        try:
+
+            running = set(probe_futures)
+            while running:
+
+                done, running = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+
+                    if future.cancelled():
+                        continue
+
+                    # A repo is resolved once all its organizations are probed, its clone starts
+                    # right away
+                    if future in probe_futures:
+                        index = probe_futures[future]
+                        if failure is not None or resolved[index] is not None or \
+                                not all(repo_future.done() for repo_future in repo_futures[index]):
+                            continue
+
+                        # A probe that raised fails the run as a failed clone does
+                        exceptions = [repo_future.exception() for repo_future in repo_futures[index]
+                                      if repo_future.exception() is not None]
+                        if exceptions:
+                            failure = f'Resolving \'{repos[index]}\' failed with exception: ' + \
+                                      f'{exceptions[0]}'
+                            cancel_pending()
+                            continue
+
+                        _, default_branch, is_tag_in = resolve_list[index]
+                        probes = [repo_future.result() for repo_future in repo_futures[index]]
+                        resolved[index] = select_url_and_branch(probes, default_branch,
+                                                                user_branch, is_tag_in)
+                        found, url, branch, is_tag = resolved[index]
+
+                        if not found and required_flags[index]:
+                            failure = f'No matching branch for repo \'{repos[index]}\' was ' + \
+                                      f'found in any organisations.'
+                        elif found and clone_flags[index]:
+                            task_logger = BufferedLogger(logger.task_name)
+                            clone_future = clone_executor.submit(clone_git_repo_buffered,
+                                                                 task_logger, repos[index], url,
+                                                                 branch, targets[index], is_tag,
+                                                                 clone_settings)
+                            clone_futures[clone_future] = (index, task_logger)
+                            running.add(clone_future)
+
+                    # Write the output of a clone in one block when it finishes
+                    else:
+                        index, task_logger = clone_futures[future]
+                        exception = future.exception()
+                        if exception is None:
+                            clone_statuses[index] = future.result()
+                            task_logger.info(f'Finished cloning \'{repos[index]}\'.')
+                        else:
+                            if not isinstance(exception, SystemExit):
+                                task_logger.send_message('ABORT', f'Cloning \'{repos[index]}\' ' +
+                                                         f'failed with exception: {exception}')
+                            if failure is None:
+                                failure = f'Cloning \'{repos[index]}\' failed, the remaining ' + \
+                                          f'tasks were cancelled.'
+                        task_logger.flush()
+
+                    # Nothing that has not started yet is run after a failure
+                    if failure is not None:
+                        cancel_pending()
+
+        except BaseException:
+            cancel_pending()
+            raise
+
+    if failure is not None:
+        logger.abort(failure)
+
+    return resolved, clone_statuses
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def local_head_sha(logger, target):
+
+    # Commit checked out in a local repo, empty if it cannot be determined
+    rc, sha = git_output(logger, ['git', 'rev-parse', 'HEAD'], target)
+    if rc != 0:
+        return ''
+
+    return sha
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+@traced('clone', 'repo', 'url', 'sha')
+def checkout_git_sha(logger, repo, url, ref, target, is_tag, sha, clone_settings):
+
+    # Put the repo at exactly the commit sha, without resolving any branch. Returns the status of
+    # the repo as for clone_git_repo.
+    logger.info(f'Checking out \'{repo}\' at {sha}.')
+    clear_command_log(logger, clone_settings, target)
+
+    depth = clone_settings.get('depth', 0)
+    filter_spec = clone_settings.get('filter', '')
+    submodule_jobs = clone_settings.get('submodule_jobs', 1)
+
+    if os.path.exists(target):
+        if local_head_sha(logger, target) == sha:
+            logger.info(f'Repo {url}, already at {sha}.')
+            return 'up to date'
+        status = 'updated'
+    else:
+        run_logged(logger, ['git', 'init', target], clone_settings, target, True)
+        cmd = ['git', 'remote', 'add', 'origin', url]
+        run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+        status = 'cloned'
+
+    # Fetch the commit directly
+    fetch_options = []
+    if depth > 0:
+        fetch_options += ['--depth', str(depth)]
+    if filter_spec != '':
+        fetch_options += [f'--filter={filter_spec}']
+    cmd = ['git', 'fetch'] + fetch_options + ['origin', sha]
+    rc = run_logged(logger, cmd, clone_settings, target, False, cwd=target).returncode
+
+    # Remotes that do not allow fetching a commit directly, fetch the ref it was locked from. The
+    # history is needed in full to be sure it contains the commit.
+    if rc != 0:
+        cmd = ['git', 'fetch', 'origin', ref]
+        run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+
+    # Tags are checked out detached as with a clone, branches as a local branch so that an update
+    # without the lock file can pull the branch later
+    if is_tag:
+        cmd = ['git', 'checkout', '--detach', sha]
+    else:
+        cmd = ['git', 'checkout', '-B', ref, sha]
+    run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+
+    cmd = ['git', 'submodule', 'update', '--init', '--recursive']
+    if submodule_jobs > 1:
+        cmd += ['--jobs', str(submodule_jobs)]
+    run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+
+    return status
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def checkout_git_shas(logger, repos, urls, refs, targets, is_tags, shas, workers,
+                      clone_settings=None):
+
+    # Check out the locked commit of several repos concurrently
+    if clone_settings is None:
+        clone_settings = {}
+
+    task_args = []
+    for repo, url, ref, target, is_tag, sha in zip(repos, urls, refs, targets, is_tags, shas):
+        task_args.append((repo, url, ref, target, is_tag, sha, clone_settings))
+
+    with deferred_lfs_environment(clone_settings):
+        checkout_statuses = run_buffered_tasks(logger, repos, checkout_git_sha, task_args, workers,
+                                               'Checking out')
+
+    return checkout_statuses
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+@traced('lfs', 'repo', 'target')
+def pull_lfs_objects(logger, repo, target, concurrent_transfers, include, exclude,
+                     clone_settings=None):
+
+    if clone_settings is None:
+        clone_settings = {}
+
+    # Only repos that track files with LFS need a pull
+    rc, lfs_files = git_output(logger, ['git', 'lfs', 'ls-files', '--name-only'], target)
+    if rc != 0 or lfs_files == '':
+        logger.info(f'No LFS files in \'{repo}\'.')
+        return False
+
+    logger.info(f'Pulling LFS objects of \'{repo}\'.')
+
+    cmd = ['git', '-c', f'lfs.concurrenttransfers={concurrent_transfers}', 'lfs', 'pull']
+    if include:
+        cmd += ['--include', ','.join(include)]
+    if exclude:
+        cmd += ['--exclude', ','.join(exclude)]
+    run_logged(logger, cmd, clone_settings, target, True, cwd=target)
+
+    return True
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def pull_lfs_objects_repos(logger, repos, targets, workers, concurrent_transfers, includes,
+                           excludes, clone_settings=None):
+
+    # Download the LFS objects of several repos concurrently. includes and excludes map a repo
+    # to the patterns that limit the files downloaded, repos that are absent get every file. The
+    # output is added to the log of each repo.
+    task_args = []
+    for repo, target in zip(repos, targets):
+        task_args.append((repo, target, concurrent_transfers, includes.get(repo),
+                          excludes.get(repo), clone_settings))
 
-        # Switch back to other directory
-        os.chdir(cwd)
+    return run_buffered_tasks(logger, repos, pull_lfs_objects, task_args, workers,
+                              'Pulling LFS objects of')
 
 
 # --------------------------------------------------------------------------------------------------
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2022 United States Government as represented by the Administrator of the
+# National Aeronautics and Space Administration. All Rights Reserved.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+
+
+import heapq
+
+from jedi_bundle.utils.config import config_get
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def build_order_dependencies(logger, build_order_dicts):
+
+    # Dependency graph of the repos in the build order, as a dictionary of each repo to the list of
+    # repos it depends on. The dictionary keeps the order of the build order file.
+    dependencies = {}
+    for build_order_dict in build_order_dicts:
+        repo = list(build_order_dict.keys())[0]
+        repo_dict = build_order_dict[repo]
+        dependencies[repo] = list(config_get(logger, repo_dict, 'depends_on', []))
+
+    validate_dependencies(logger, dependencies)
+
+    return dependencies
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def validate_dependencies(logger, dependencies):
+
+    # Every dependency must be a repo of the graph
+    for repo, repo_dependencies in dependencies.items():
+        for dependency in repo_dependencies:
+            if dependency not in dependencies:
+                logger.abort(f'Repository \'{repo}\' depends on \'{dependency}\' which is not ' +
+                             f'in the build order.')
+
+    # The graph must not contain cycles. Sorting all the repos fails if it does.
+    topological_sort(logger, dependencies, list(dependencies.keys()))
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def dependency_closure(logger, dependencies, repos):
+
+    # The repos together with everything they depend on, directly or not
+    closure = set()
+    to_visit = list(repos)
+    while to_visit:
+        repo = to_visit.pop()
+        if repo in closure:
+            continue
+        if repo not in dependencies:
+            logger.abort(f'Repository \'{repo}\' not found anywhere in the build order.')
+        closure.add(repo)
+        to_visit.extend(dependencies[repo])
+
+    return closure
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def topological_sort(logger, dependencies, repos):
+
+    # Order repos so that every repo comes after the repos it depends on. Only dependencies within
+    # repos are considered. Ties are broken by the order of the dependencies dictionary so that
+    # when the build order file is already valid its order is kept.
+    for repo in repos:
+        if repo not in dependencies:
+            logger.abort(f'Repository \'{repo}\' not found anywhere in the build order. Make ' +
+                         f'sure to add to the build-order.yaml in jedi_bundle.')
+
+    position = {repo: index for index, repo in enumerate(dependencies)}
+    repos = set(repos)
+
+    # Number of dependencies not yet placed and the reverse edges for each repo
+    remaining = {repo: 0 for repo in repos}
+    dependents = {repo: [] for repo in repos}
+    for repo in repos:
+        for dependency in dependencies[repo]:
+            if dependency in repos:
+                remaining[repo] += 1
+                dependents[dependency].append(repo)
+
+    ready = [(position[repo], repo) for repo in repos if remaining[repo] == 0]
+    heapq.heapify(ready)
+
+    ordered = []
+    while ready:
+        _, repo = heapq.heappop(ready)
+        ordered.append(repo)
+        for dependent in dependents[repo]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                heapq.heappush(ready, (position[dependent], dependent))
+
+    if len(ordered) != len(repos):
+        cycle_repos = sorted(repo for repo in repos if remaining[repo] > 0)
+        logger.abort(f'The dependencies of the repositories {cycle_repos} contain a cycle.')
+
+    return ordered
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def bundle_waits(logger, dependencies, bundles):
+
+    # Bundles are built in their own directory of the build tree and each build also builds the
+    # repos the bundle depends on. Two bundles can only be built at the same time when everything
+    # they have in common has already been built. For each bundle this returns the bundles it has
+    # to wait for: the bundles it depends on, and any bundle earlier in the order that shares a
+    # repo not already built by the bundles it depends on.
+    ordered_bundles = topological_sort(logger, dependencies, bundles)
+
+    closures = {}
+    for bundle in ordered_bundles:
+        closures[bundle] = dependency_closure(logger, dependencies, [bundle])
+
+    waits = {}
+    for index, bundle in enumerate(ordered_bundles):
+
+        bundle_dependencies = [other for other in ordered_bundles[:index]
+                               if other in closures[bundle]]
+
+        built_by_dependencies = set()
+        for other in bundle_dependencies:
+            built_by_dependencies |= closures[other]
+
+        waits[bundle] = list(bundle_dependencies)
+        for other in ordered_bundles[:index]:
+            if other in bundle_dependencies:
+                continue
+            if (closures[other] & closures[bundle]) - built_by_dependencies:
+                waits[bundle].append(other)
+
+    return ordered_bundles, waits
+
+
+# --------------------------------------------------------------------------------------------------
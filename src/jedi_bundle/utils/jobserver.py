@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2022 United States Government as represented by the Administrator of the
+# National Aeronautics and Space Administration. All Rights Reserved.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+
+
+import os
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+class Jobserver:
+
+    # A GNU make jobserver shared by several top level make processes. Every make started with
+    # makeflags() in its environment draws job tokens from the same pipe so that together they
+    # never run more jobs than the budget. Each make also runs one job without a token, so the
+    # pipe holds the budget minus the number of makes that can run at the same time.
+
+    def __init__(self, jobs, makes):
+
+        self.tokens = max(0, jobs - makes)
+        self.read_fd, self.write_fd = os.pipe()
+        os.write(self.write_fd, b'+' * self.tokens)
+
+    # ----------------------------------------------------------------------------------------------
+
+    def fds(self):
+
+        return (self.read_fd, self.write_fd)
+
+    # ----------------------------------------------------------------------------------------------
+
+    def makeflags(self):
+
+        # jobserver-fds is understood by all GNU make versions that support a jobserver, newer
+        # versions treat it as an alias of jobserver-auth
+        return f' -j --jobserver-fds={self.read_fd},{self.write_fd}'
+
+    # ----------------------------------------------------------------------------------------------
+
+    def environment(self):
+
+        environment = dict(os.environ)
+        environment['MAKEFLAGS'] = self.makeflags()
+        return environment
+
+    # ----------------------------------------------------------------------------------------------
+
+    def close(self):
+
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    # ----------------------------------------------------------------------------------------------
+
+    def __enter__(self):
+
+        return self
+
+    # ----------------------------------------------------------------------------------------------
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close()
+
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2022 United States Government as represented by the Administrator of the
+# National Aeronautics and Space Administration. All Rights Reserved.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+
+
+import os
+import yaml
+
+from jedi_bundle.utils.config import config_get
+from jedi_bundle.utils.file_system import write_file_if_changed
+from jedi_bundle.utils.yaml import load_yaml
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def lock_file_path(path_to_source):
+
+    return os.path.join(path_to_source, 'jedi_bundle.lock.yaml')
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def write_lock_file(logger, pathfile, repos, urls, refs, is_tags, shas):
+
+    # Record the exact commit of each repo so that the bundle can be reproduced
+    lock_repos = []
+    for repo, url, ref, is_tag, sha in zip(repos, urls, refs, is_tags, shas):
+        lock_repos.append({
+            'repo': repo,
+            'url': url,
+            'ref': ref,
+            'tag': is_tag,
+            'sha': sha,
+        })
+
+    lock_content = yaml.dump({'repos': lock_repos}, default_flow_style=False, sort_keys=False)
+    write_file_if_changed(logger, pathfile, lock_content)
+
+    logger.info(f'Commits of the cloned repositories written to {pathfile}')
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def read_lock_file(logger, pathfile):
+
+    # Returns a dictionary of the lock file entries keyed by the repo name
+    if not os.path.exists(pathfile):
+        logger.abort(f'Running in locked mode but the lock file {pathfile} does not exist. Run ' +
+                     f'the clone once without --locked to create it.')
+
+    lock_dict = load_yaml(logger, pathfile)
+
+    lock_entries = {}
+    for lock_repo in config_get(logger, lock_dict, 'repos'):
+        for key in ['repo', 'url', 'ref', 'tag', 'sha']:
+            if key not in lock_repo:
+                logger.abort(f'Entry {lock_repo} of the lock file {pathfile} is missing \'{key}\'.')
+        lock_entries[lock_repo['repo']] = lock_repo
+
+    return lock_entries
+
+
+# --------------------------------------------------------------------------------------------------
@@ -9,6 +9,7 @@
 
 import os
 import sys
+import threading
 
 
 # --------------------------------------------------------------------------------------------------
@@ -113,3 +114,42 @@ class Logger:
         input(f'INFO {self.task_name}: {colors.warning}Press any key to continue...{colors.norm}\n')
 
     # ----------------------------------------------------------------------------------------------
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+class BufferedLogger(Logger):
+
+    # Logger that holds on to its messages so that the output of a task running concurrently with
+    # other tasks can be written in one block once it is finished.
+
+    # Lock shared by all buffered loggers so that blocks of messages are never interleaved
+    flush_lock = threading.Lock()
+
+    def __init__(self, task_name):
+
+        super().__init__(task_name)
+        self.messages = []
+
+    # ----------------------------------------------------------------------------------------------
+
+    def send_message(self, level, message):
+
+        level_show = ''
+        if level != 'BLANK':
+            level_show = level + ' '+self.task_name+': '
+
+        if level == 'ABORT' or self.loggerdict[level]:
+            self.messages.append(level_show+message)
+
+    # ----------------------------------------------------------------------------------------------
+
+    def flush(self):
+
+        with BufferedLogger.flush_lock:
+            if self.messages:
+                print('\n'.join(self.messages), flush=True)
+            self.messages = []
+
+    # ----------------------------------------------------------------------------------------------
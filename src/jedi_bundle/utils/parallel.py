@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2022 United States Government as represented by the Administrator of the
+# National Aeronautics and Space Administration. All Rights Reserved.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+
+
+import concurrent.futures
+import time
+
+from jedi_bundle.utils.logger import BufferedLogger
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def run_buffered_tasks(logger, names, task, task_args, workers, action):
+
+    # Run task(task_logger, *args) for each element of task_args with a bounded pool of workers.
+    # The output of each task is captured by its own buffered logger and written in one block when
+    # the task finishes. After the first failure the tasks that have not started are cancelled
+    # while the running tasks are left to finish. Returns the result of each task in the order of
+    # names.
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+
+        futures = {}
+        for name, args in zip(names, task_args):
+            task_logger = BufferedLogger(logger.task_name)
+            future = executor.submit(task, task_logger, *args)
+            futures[future] = (name, task_logger)
+
+        failed_name = None
+        completed = 0
+        for future in concurrent.futures.as_completed(futures):
+
+            name, task_logger = futures[future]
+            if future.cancelled():
+                continue
+
+            # Exceptions other than an abort have not been written by the task logger
+            exception = future.exception()
+            if exception is not None and not isinstance(exception, SystemExit):
+                task_logger.send_message('ABORT', f'{action} \'{name}\' failed with exception: ' +
+                                         f'{exception}')
+
+            completed = completed + 1
+            if exception is None:
+                task_logger.info(f'Finished {action[0].lower() + action[1:]} \'{name}\' ' +
+                                 f'({completed}/{len(futures)}).')
+            task_logger.flush()
+
+            # Cancel everything that has not started yet
+            if exception is not None and failed_name is None:
+                failed_name = name
+                for other_future in futures:
+                    other_future.cancel()
+
+    if failed_name is not None:
+        logger.abort(f'{action} \'{failed_name}\' failed, the remaining tasks were cancelled.')
+
+    return [future.result() for future in futures]
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def run_dependent_tasks(logger, names, waits, task, task_args, workers):
+
+    # Run task(*args) for each element of task_args with a bounded pool of workers, starting a
+    # task only once all the tasks it waits for have passed. A task passes when it returns True.
+    # When a task fails the tasks waiting on it, directly or not, are skipped while independent
+    # tasks carry on. Returns the status ('passed', 'failed' or 'skipped') and the duration in
+    # seconds of each task in the order of names.
+
+    args_of_name = dict(zip(names, task_args))
+    statuses = {}
+    durations = {name: 0.0 for name in names}
+    pending = list(names)
+
+    # A task that raises, including one that aborts, fails like a task that returns False
+    def timed_task(name, *args):
+        start_time = time.time()
+        try:
+            passed = task(*args)
+        except SystemExit:
+            logger.info(f'Task \'{name}\' aborted.')
+            passed = False
+        except Exception as e:
+            logger.info(f'Task \'{name}\' failed with exception: {e}')
+            passed = False
+        return passed, time.time() - start_time
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+
+        running = {}
+        while pending or running:
+
+            # Skip tasks that wait on a task that did not pass and start those that are ready
+            for name in list(pending):
+                if any(statuses.get(other) in ['failed', 'skipped'] for other in waits[name]):
+                    statuses[name] = 'skipped'
+                    pending.remove(name)
+                elif len(running) < max(1, workers) and \
+                        all(statuses.get(other) == 'passed' for other in waits[name]):
+                    future = executor.submit(timed_task, name, *args_of_name[name])
+                    running[future] = name
+                    pending.remove(name)
+
+            if not running:
+                continue
+
+            done, _ = concurrent.futures.wait(running,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                passed, durations[name] = future.result()
+                statuses[name] = 'passed' if passed else 'failed'
+
+    return [(statuses[name], durations[name]) for name in names]
+
+
+# --------------------------------------------------------------------------------------------------
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# (C) Copyright 2022 United States Government as represented by the Administrator of the
+# National Aeronautics and Space Administration. All Rights Reserved.
+#
+# This software is licensed under the terms of the Apache Licence Version 2.0
+# which can be obtained at http://www.apache.org/licenses/LICENSE-2.0.
+
+# --------------------------------------------------------------------------------------------------
+
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+class Tracer:
+
+    # Collects timed spans in the Chrome trace event format, which chrome://tracing and Perfetto
+    # can open. Nothing is recorded until the tracer is enabled.
+
+    def __init__(self):
+
+        self.pathfile = None
+        self.events = []
+        self.thread_names = {}
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+
+    # ----------------------------------------------------------------------------------------------
+
+    def enabled(self):
+
+        return self.pathfile is not None
+
+    # ----------------------------------------------------------------------------------------------
+
+    def enable(self, pathfile):
+
+        self.pathfile = os.path.abspath(pathfile)
+
+    # ----------------------------------------------------------------------------------------------
+
+    def add_span(self, name, category, start_time, end_time, args):
+
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int((start_time - self.start_time) * 1e6),
+            'dur': int((end_time - start_time) * 1e6),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': {key: str(value) for key, value in args.items()},
+        }
+        with self.lock:
+            self.events.append(event)
+            self.thread_names[event['tid']] = threading.current_thread().name
+
+    # ----------------------------------------------------------------------------------------------
+
+    def write(self, logger):
+
+        if not self.enabled():
+            return
+
+        # Name the threads so that the viewer shows them in a readable way
+        with self.lock:
+            events = list(self.events)
+            thread_names = [{
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': {'name': thread_name},
+            } for tid, thread_name in self.thread_names.items()]
+
+        try:
+            with open(self.pathfile, 'w') as trace_file:
+                json.dump({'traceEvents': thread_names + events, 'displayTimeUnit': 'ms'},
+                          trace_file)
+            logger.info(f'Trace of the run written to {self.pathfile}')
+        except Exception as e:
+            logger.info(f'Failed to write the trace to {self.pathfile}: {e}')
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+# The tracer for the whole process
+tracer = Tracer()
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+@contextlib.contextmanager
+def trace_span(name, category, **args):
+
+    # Record the time spent in the body as a span named name with the given attributes
+    if not tracer.enabled():
+        yield
+        return
+
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        tracer.add_span(name, category, start_time, time.time(), args)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
+def traced(category, *arg_names):
+
+    # Decorator recording each call of a function as a span. The named arguments of the call are
+    # recorded as attributes of the span.
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled():
+                return function(*args, **kwargs)
+            call_args = dict(zip(function.__code__.co_varnames, args))
+            call_args.update(kwargs)
+            span_args = {name: call_args[name] for name in arg_names if name in call_args}
+            with trace_span(function.__name__, category, **span_args):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# --------------------------------------------------------------------------------------------------
@@ -15,12 +15,19 @@ import yaml
 # --------------------------------------------------------------------------------------------------
 
 
+# Use the libyaml parser when PyYAML was built with it
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+# --------------------------------------------------------------------------------------------------
+
+
 def load_yaml(logger, pathfile):
 
     # Convert the config file to a dictionary
     try:
         with open(pathfile, 'r') as pathfile_opened:
-            dict = yaml.safe_load(pathfile_opened)
+            dict = yaml.load(pathfile_opened, Loader=SafeLoader)
     except Exception as e:
         logger.abort(f'Jedi build code f is expecting a valid yaml file, but it encountered ' +
                      f'errors when attempting to load: {pathfile}, error: {e}')